@@ -0,0 +1,122 @@
+"""Memory against step time of a SRGAN training step for several activation checkpointing configurations.
+
+    python benchmarks/checkpointing.py                    # table of every configuration in CONFIGS
+    python benchmarks/checkpointing.py --hr 512 --bs 2    # at the training patch size
+
+Each configuration runs in its own process so the peak memory of one doesn't hide the others. The peak is
+`torch.cuda.max_memory_allocated` on GPU and the process max RSS on CPU (which includes the interpreter and
+the weights, compare the configurations between them rather than the absolute values).
+"""
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import torch
+from torch import nn
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT/'task9_srres'/'srgan_pytorch'))
+
+import models
+
+
+# (generator segments, discriminator segments), 0 keeps every activation
+CONFIGS = [(0, 0), (1, 0), (2, 0), (4, 0), (8, 0), (16, 0), (4, 1), (4, 3), (4, 7)]
+HR = 256
+BATCH_SIZE = 2
+SCALE = 2
+WARMUP = 1
+REPEAT = 3
+
+
+def training_step(G, D, opt_G, opt_D, lr, hr):
+    "Discriminator then generator update, as in `train.train` without the content loss"
+    bce = nn.BCELoss()
+    fake = G(lr)
+    opt_D.zero_grad()
+    d_real, d_fake = D(hr), D(fake.detach())
+    (bce(d_real, torch.ones_like(d_real)) + bce(d_fake, torch.zeros_like(d_fake))).backward()
+    opt_D.step()
+
+    opt_G.zero_grad()
+    d_fake = D(fake)
+    (nn.functional.mse_loss(fake, hr) + 1e-2 * bce(d_fake, torch.ones_like(d_fake))).backward()
+    opt_G.step()
+
+
+def measure_config(g_segments, d_segments, hr_size=HR, bs=BATCH_SIZE, repeat=REPEAT, warmup=WARMUP):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    torch.manual_seed(0)
+    G = models.GeneratorBNFirst(3, 3, upscale=SCALE, checkpoint_segments=g_segments).to(device).train()
+    D = models.Discriminator(48, hr_size, sigmoid=True, checkpoint_segments=d_segments).to(device).train()
+    opt_G, opt_D = torch.optim.Adam(G.parameters()), torch.optim.Adam(D.parameters())
+    hr = torch.rand(bs, 3, hr_size, hr_size, device=device)
+    lr = torch.rand(bs, 3, hr_size // SCALE, hr_size // SCALE, device=device)
+
+    for _ in range(warmup):
+        training_step(G, D, opt_G, opt_D, lr, hr)
+    if device == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        training_step(G, D, opt_G, opt_D, lr, hr)
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+
+    if device == 'cuda':
+        peak_mb = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        # ru_maxrss is in kilobytes on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    return {'g_segments': g_segments, 'd_segments': d_segments, 'hr': hr_size, 'batch_size': bs, 'device': device,
+            'peak_mb': peak_mb, 'step_s': statistics.median(times)}
+
+
+def trade_off(configs=CONFIGS, hr_size=HR, bs=BATCH_SIZE):
+    "`measure_config` of every configuration, each in a new process"
+    res = []
+    for g_segments, d_segments in configs:
+        proc = subprocess.run([sys.executable, __file__, '--child', str(g_segments), str(d_segments),
+                               '--hr', str(hr_size), '--bs', str(bs)], stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            # Out of memory kills the process on CPU, that is a result too
+            res.append({'g_segments': g_segments, 'd_segments': d_segments, 'hr': hr_size, 'batch_size': bs,
+                        'error': f'exit code {proc.returncode}'})
+            continue
+        res.append(json.loads(proc.stdout.decode().strip().splitlines()[-1]))
+
+    done = [r for r in res if 'error' not in r]
+    for r in done:
+        r['memory_vs_first'] = r['peak_mb'] / done[0]['peak_mb']
+        r['time_vs_first'] = r['step_s'] / done[0]['step_s']
+    return res
+
+
+def print_table(res):
+    print(f"{'G segments':>10} {'D segments':>10} {'peak MB':>10} {'step s':>8} {'memory':>7} {'time':>6}")
+    for r in res:
+        if 'error' in r:
+            print(f"{r['g_segments']:>10} {r['d_segments']:>10}   failed ({r['error']})")
+            continue
+        print(f"{r['g_segments']:>10} {r['d_segments']:>10} {r['peak_mb']:>10.0f} {r['step_s']:>8.3f} "
+              f"{r['memory_vs_first']:>6.2f}x {r['time_vs_first']:>5.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--child', nargs=2, type=int, metavar=('G_SEGMENTS', 'D_SEGMENTS'))
+    parser.add_argument('--hr', type=int, default=HR)
+    parser.add_argument('--bs', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    if args.child is not None:
+        print(json.dumps(measure_config(*args.child, hr_size=args.hr, bs=args.bs)))
+    else:
+        print_table(trade_off(hr_size=args.hr, bs=args.bs))
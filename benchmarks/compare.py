@@ -0,0 +1,42 @@
+"""Compare two benchmark results of run_benchmarks.py, slower timings above the threshold are reported as regressions.
+
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json [threshold]
+"""
+import json
+import sys
+
+
+THRESHOLD = 0.10
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old, new, threshold=THRESHOLD):
+    "Rows of (name, old median, new median, relative change), and the names of the regressions"
+    rows, regressions = [], []
+    for name, stats in new['results'].items():
+        before = old['results'].get(name, {})
+        if 'median_s' not in stats or 'median_s' not in before:
+            continue
+        change = stats['median_s'] / before['median_s'] - 1
+        rows.append((name, before['median_s'], stats['median_s'], change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    old, new = load(sys.argv[1]), load(sys.argv[2])
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else THRESHOLD
+    if old['machine'] != new['machine']:
+        print(f"Warning: results come from different machines\n  {old['machine']}\n  {new['machine']}")
+
+    rows, regressions = compare(old, new, threshold)
+    print(f"{'benchmark':60s} {old['commit']:>10s} {new['commit']:>10s}  change")
+    for name, before, after, change in rows:
+        flag = '  <- regression' if name in regressions else ''
+        print(f'{name:60s} {before * 1000:9.2f}ms {after * 1000:9.2f}ms  {change:+.1%}{flag}')
+    sys.exit(1 if regressions else 0)
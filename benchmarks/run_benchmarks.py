@@ -0,0 +1,276 @@
+"""Benchmarks of the data loaders, models, losses and preprocessing kernels, on synthetic data and CPU only.
+
+    python benchmarks/run_benchmarks.py                  # every group, saved in benchmarks/results/<commit>.json
+    python benchmarks/run_benchmarks.py models losses    # only some groups
+    python benchmarks/run_benchmarks.py cli              # cold start of `wfp --help` and of the light stages
+    python benchmarks/checkpointing.py                   # memory / step time table of activation checkpointing
+    python benchmarks/compare.py results/<old>.json results/<new>.json
+"""
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT/'task9_srres'/'srgan_pytorch'), str(ROOT/'task9_srres'/'nogan'), str(ROOT/'task4_resnet')]
+
+import checkpointing
+import loaders
+import losses
+import models
+import preprocessing
+
+
+RESULTS_PATH = ROOT/'benchmarks'/'results'
+SEED = 42
+THREADS = 4
+WARMUP = 2
+REPEAT = 10
+
+# Synthetic dataset
+N_IMAGES = 64
+IMAGE_SIZE = 300
+HR_PATCH = (256, 256)
+SCALE = 2
+LOADER_BATCH_SIZE = 4
+LOADER_WORKERS = [0, 1, 2, 4]
+
+# Models and losses, sizes are the LR side for the generator and the HR side for the rest
+GENERATOR_PATCHES = [32, 64, 128]
+DISCRIMINATOR_PATCHES = [64, 128, 256]
+LOSS_PATCHES = [128, 256]
+BATCH_SIZE = 2
+VGG_FEATURE_LAYER = 34
+
+# Command line cold start, every run is a new interpreter
+CLI_PATH = ROOT/'wfp_cli.py'
+CLI_COMMANDS = ['download', 'crop', 'stats', 'train-sr', 'super-resolve', 'classify', 'map']
+CLI_TILES = 64
+
+
+def seed_everything(seed=SEED):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def measure(fn, repeat=REPEAT, warmup=WARMUP):
+    "Median, min and mean wall time of `fn()` in seconds"
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'mean_s': statistics.mean(times),
+            'repeat': repeat}
+
+
+def make_images(folder, n=N_IMAGES, size=IMAGE_SIZE):
+    for i in range(n):
+        pixels = np.random.randint(0, 256, (size, size, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(folder, f'{i:04d}.png'))
+
+
+def bench_loaders():
+    res = OrderedDict()
+    with tempfile.TemporaryDirectory() as folder:
+        make_images(folder)
+        ds = loaders.SatelliteDataset(folder, HR_PATCH, scale_factor=SCALE)
+        for workers in LOADER_WORKERS:
+            dl = DataLoader(ds, LOADER_BATCH_SIZE, shuffle=True, num_workers=workers)
+
+            def epoch():
+                for _ in dl:
+                    pass
+            stats = measure(epoch, repeat=3, warmup=1)
+            stats['samples_per_s'] = len(ds) / stats['median_s']
+            res[f'satellite_dataset/workers={workers}'] = stats
+    return res
+
+
+def bench_augmentations():
+    with tempfile.TemporaryDirectory() as folder:
+        ds = loaders.SatelliteDataset(folder, HR_PATCH, scale_factor=SCALE)
+    image = Image.fromarray(np.random.randint(0, 256, (IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8))
+
+    def pipeline():
+        hres = ds.hr_tfms(image)
+        lres = ds.lr_tfms(hres)
+        ds.to_tensor(lres), ds.to_tensor(hres)
+    stats = measure(lambda: [pipeline() for _ in range(10)])
+    stats['samples_per_s'] = 10 / stats['median_s']
+    return {'satellite_dataset/hr_lr_transforms': stats}
+
+
+def forward_backward(model, x):
+    model.zero_grad()
+    model(x).mean().backward()
+
+
+def bench_models():
+    res = OrderedDict()
+    G = models.GeneratorBNFirst(3, 3, upscale=SCALE)
+    for size in GENERATOR_PATCHES:
+        x = torch.rand(BATCH_SIZE, 3, size, size)
+        with torch.no_grad():
+            res[f'generator/forward/lr={size}'] = measure(lambda: G(x))
+        res[f'generator/forward_backward/lr={size}'] = measure(lambda: forward_backward(G, x))
+
+    for size in DISCRIMINATOR_PATCHES:
+        D = models.Discriminator(48, size, sigmoid=True)
+        x = torch.rand(BATCH_SIZE, 3, size, size)
+        with torch.no_grad():
+            res[f'discriminator/forward/hr={size}'] = measure(lambda: D(x))
+        res[f'discriminator/forward_backward/hr={size}'] = measure(lambda: forward_backward(D, x))
+    return res
+
+
+def saved_mb(fn):
+    "Megabytes of tensors autograd keeps for the backward of `fn()`, the activation memory whatever the device"
+    storages = dict()
+
+    def pack(t):
+        storages[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        fn()
+    return sum(storages.values()) / 2**20
+
+
+def loss_backward(loss, fake, real):
+    fake.grad = None
+    loss(fake, real).backward()
+
+
+def bench_losses():
+    res = OrderedDict()
+    content_loss = losses.ContentLoss(VGG_FEATURE_LAYER, 'l2', pretrained=False)
+    for size in LOSS_PATCHES:
+        fake = torch.rand(BATCH_SIZE, 3, size, size, requires_grad=True)
+        real = torch.rand(BATCH_SIZE, 3, size, size)
+        with torch.no_grad():
+            res[f'content_loss/forward/hr={size}'] = measure(lambda: content_loss(fake, real))
+        res[f'content_loss/forward_backward/hr={size}'] = measure(lambda: loss_backward(content_loss, fake, real))
+        res[f'content_loss/forward_backward/hr={size}']['saved_mb'] = saved_mb(lambda: content_loss(fake, real))
+
+    try:
+        from torchvision.models import vgg16_bn
+        from feature_loss import FeatureLoss
+    except ImportError as e:
+        res['feature_loss'] = {'skipped': str(e)}
+        return res
+
+    vgg_m = vgg16_bn(False).features.eval()
+    for p in vgg_m.parameters():
+        p.requires_grad_(False)
+    blocks = [i-1 for i, o in enumerate(vgg_m.children()) if isinstance(o, torch.nn.MaxPool2d)]
+    feat_loss = FeatureLoss(vgg_m, blocks[2:5], [5, 15, 2])
+    for size in LOSS_PATCHES:
+        fake = torch.rand(BATCH_SIZE, 3, size, size, requires_grad=True)
+        real = torch.rand(BATCH_SIZE, 3, size, size)
+        with torch.no_grad():
+            res[f'feature_loss/forward/hr={size}'] = measure(lambda: feat_loss(fake, real))
+        res[f'feature_loss/forward_backward/hr={size}'] = measure(lambda: loss_backward(feat_loss, fake, real))
+        res[f'feature_loss/forward_backward/hr={size}']['saved_mb'] = saved_mb(lambda: feat_loss(fake, real))
+    return res
+
+
+def bench_kernels():
+    res = OrderedDict()
+    raw = np.random.randint(0, 4000, (80, 80, 13)).astype(np.uint16)
+    res['center_crop_allbands/80->64'] = measure(
+        lambda: [np.ascontiguousarray(preprocessing.center_crop_allbands(raw, 64)) for _ in range(1000)])
+
+    stats = (raw.reshape(-1, 13).mean(0), raw.reshape(-1, 13).std(0))
+    tiles = np.random.randint(0, 4000, (256, 64, 64, 13)).astype(np.uint16)
+    res['normalize_bands/256x64x64x13'] = measure(lambda: preprocessing.normalize_bands(tiles, stats))
+
+    scene = np.random.randint(0, 4000, (500, 500, 13)).astype(np.uint16)
+    res['visualize_all_bands/500x500x13'] = measure(lambda: preprocessing.visualize_all_bands(scene))
+
+    image = Image.fromarray(np.random.randint(0, 256, (600, 600, 3), dtype=np.uint8))
+    res['center_crop/600->512'] = measure(lambda: [preprocessing.center_crop(image, 512) for _ in range(100)])
+    return res
+
+
+def run_cli(*args):
+    subprocess.run([sys.executable, str(CLI_PATH), *args], check=True, stdout=subprocess.DEVNULL)
+
+
+def bench_cli():
+    res = OrderedDict()
+    res['wfp/--help'] = measure(lambda: run_cli('--help'), repeat=5, warmup=1)
+    for command in CLI_COMMANDS:
+        res[f'wfp {command}/--help'] = measure(lambda: run_cli(command, '--help'), repeat=5, warmup=1)
+
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(CLI_TILES):
+            np.save(os.path.join(folder, f'{i:04d}.npy'), np.random.randint(0, 4000, (64, 64, 13)).astype(np.uint16))
+        res[f'wfp stats/{CLI_TILES}_tiles'] = measure(lambda: run_cli('stats', folder), repeat=5, warmup=1)
+    return res
+
+
+def bench_checkpointing():
+    res = OrderedDict()
+    for r in checkpointing.trade_off():
+        name = f"train_step/G={r['g_segments']},D={r['d_segments']}/hr={r['hr']}"
+        res[name] = dict(r, median_s=r['step_s']) if 'error' not in r else dict(r, skipped=r['error'])
+    return res
+
+
+BENCHMARKS = OrderedDict([('loaders', bench_loaders), ('augmentations', bench_augmentations),
+                          ('models', bench_models), ('losses', bench_losses), ('kernels', bench_kernels),
+                          ('cli', bench_cli), ('checkpointing', bench_checkpointing)])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(groups=None, output=None):
+    groups = groups or list(BENCHMARKS)
+    torch.set_num_threads(THREADS)
+    commit = git_commit()
+    report = {'commit': commit, 'date': datetime.now().isoformat(timespec='seconds'),
+              'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                          'python': platform.python_version(), 'torch': torch.__version__, 'threads': THREADS},
+              'results': OrderedDict()}
+
+    for group in groups:
+        print(f'Running {group}')
+        seed_everything()
+        for name, stats in BENCHMARKS[group]().items():
+            report['results'][f'{group}/{name}'] = stats
+            print(f"  {name}: {stats.get('median_s', stats.get('skipped'))}"
+                  + (f", saved {stats['saved_mb']:.1f}MB" if 'saved_mb' in stats else ''))
+
+    output = Path(output) if output is not None else RESULTS_PATH/f'{commit}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved to {output}')
+    return report
+
+
+if __name__ == '__main__':
+    unknown = [g for g in sys.argv[1:] if g not in BENCHMARKS]
+    assert not unknown, f'Unknown groups {unknown}, choose from {list(BENCHMARKS)}'
+    run(sys.argv[1:])
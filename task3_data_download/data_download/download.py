@@ -0,0 +1,167 @@
+import datetime
+import random
+import time
+import numpy as np
+import pandas as pd
+import ee
+
+
+# GOOGLE DRIVE FOLDER
+GDRIVE_FOLDER = 'wfp-allbands-unlabeled-b1'
+# The labeled survey tiles are kept apart from the unlabeled ones
+SURVEY_GDRIVE_FOLDER = 'wfp-allbands-b1'
+
+# 13 bands or RGB?
+ALL_BANDS = True
+
+# NUMBER OF FILES TO DOWNLOAD
+DOWNLOAD_NB_FILES = 3000
+
+# RADIUS AROUND COORD IN METERS
+# This is the number of meter around the point coordinate to include in the picture
+RADIUS_AROUND = 400
+
+# RANGES FOR BANDS (RGB only)
+RANGE_MIN = 0
+RANGE_MAX = 2000
+
+# RANGE FOR DATES
+# we need to take several pictures to select ones without clouds
+# We look for RANGE_DATE weeks around the date
+# (2 weeks for the random tiles as in notebook 25, 1.5 weeks around the survey date as in notebook 24)
+RANGE_DATE = 2
+SURVEY_RANGE_DATE = 1.5
+
+# TIME OF INTEREST
+# A random date is selected between TOI_BEGIN and TOI_END
+TOI_BEGIN = '01/01/2016'
+TOI_END = '01/06/2019'
+
+# MAXIMUM % OF CLOUDS
+MAX_CLOUDS = 10
+
+# When the export task list is full, wait before trying again
+TASK_LIST_FULL_SLEEP = 2*60*60
+
+# REGION TO TAKE PICTURE FROM
+NEPAL_POLYGON = [[84.46716739280828,29.108665503908366],
+[82.84929902963563,29.95080069391136],
+[81.9899776971655,30.413866129203402],
+[81.01575580840813,30.491203262843925],
+[79.96277286155828,28.849173773303857],
+[82.82709294386302,27.405490759555242],
+[83.79152604893773,27.280548634789366],
+[84.12517363514314,27.354698207754293],
+[84.61046405920763,27.23515863534531],
+[84.56770354968148,26.99802099337535],
+[86.30188418968328,26.48893917833053],
+[86.80725528343328,28.128845548855082],
+[85.631313693822,28.638952723497773],
+[84.46716739280828,29.108665503908366]]
+
+
+def stringify_date(date):
+    return date.strftime("%d/%m/%Y")
+
+
+def get_name_im(x, y, date):
+    return f"{str(x)[:9].replace('.', '-')}_{str(y)[:9].replace('.', '-')}_{date}"
+
+
+def random_date(start, end):
+    """Generate a random datetime between `start` and `end`"""
+    return start + datetime.timedelta(
+        # Get a random amount of seconds between `start` and `end`
+        seconds=random.randint(0, int((end - start).total_seconds())),
+    )
+
+
+def get_date(data_str):
+    d, m, y = data_str.split('/')
+
+    return datetime.date(int(y), int(m), int(d))
+
+
+def get_random_coordinate(geometry):
+    rd_points = ee.FeatureCollection.randomPoints(geometry, 1, random.randint(0, int(1e10)))
+
+    return rd_points.getInfo()['features'][0]['geometry']['coordinates']
+
+
+# Generate a rectangle containing the circle (centered on the coordinate) with radius RADIUS_AROUND
+def get_geometry_radius(geometry_point):
+    coord = np.array(geometry_point.getInfo()['coordinates'][0])
+    return ee.Geometry.Rectangle([coord[:, 0].min(), coord[:, 1].min(), coord[:, 0].max(), coord[:, 1].max()])
+
+
+# Generate the dates around the observation date
+def date_range_to_collect(input_date, range_date=RANGE_DATE):
+    target_date = get_date(input_date)
+    delta = datetime.timedelta(weeks=range_date)
+    return target_date-delta, target_date+delta
+
+
+def get_collection(max_clouds=MAX_CLOUDS):
+    return ee.ImageCollection('COPERNICUS/S2').filterMetadata('CLOUDY_PIXEL_PERCENTAGE', 'less_than', max_clouds)
+
+
+def generate_image(image_collection, x, y, date, image_name, gdrive_folder=GDRIVE_FOLDER, all_bands=ALL_BANDS,
+                   debug=True, range_date=RANGE_DATE):
+    if debug: print(f'Working on {image_name}: ({x}, {y}) on {date}')
+    geo = ee.Geometry.Point(x, y)
+    radius = geo.buffer(RADIUS_AROUND)
+    geometry_radius = get_geometry_radius(radius)
+
+    spatialFiltered = image_collection.filterBounds(geo)
+
+    date_range = date_range_to_collect(date, range_date)
+    if debug: print('date range:' + str(date_range[0]) + str(date_range[1]))
+    temporalFiltered = spatialFiltered.filterDate(str(date_range[0]), str(date_range[1]))
+
+    least_clouds = temporalFiltered.sort('CLOUD_PIXEL_PERCENTAGE').first()
+
+    if all_bands:
+        testimg = least_clouds.select('B.+')
+    else:
+        testimg = least_clouds.visualize(bands=['B4', 'B3', 'B2'], min=RANGE_MIN, max=RANGE_MAX)
+
+    region = geometry_radius.getInfo()['coordinates'][0]
+    try:
+        task = ee.batch.Export.image.toDrive(testimg, folder=gdrive_folder, region=region, description=image_name, scale=10)
+        task.start()
+    except Exception:
+        print(f'EXCEPTION DURING DOWNLOAD => TASK LIST SHOULD BE FULL. SLEEP FOR {TASK_LIST_FULL_SLEEP}s')
+        time.sleep(TASK_LIST_FULL_SLEEP)
+        task = ee.batch.Export.image.toDrive(testimg, folder=gdrive_folder, region=region, description=image_name, scale=10)
+        task.start()
+
+
+def download_random(nb_files=DOWNLOAD_NB_FILES, gdrive_folder=GDRIVE_FOLDER, all_bands=ALL_BANDS, debug=True):
+    "Export `nb_files` tiles at random points of Nepal and random dates, named {x}_{y}_{date}"
+    ee.Initialize()
+    nepal = ee.Geometry.Polygon(NEPAL_POLYGON)
+    dataset = get_collection()
+    start, end = get_date(TOI_BEGIN), get_date(TOI_END)
+    for _ in range(nb_files):
+        date = random_date(start, end)
+        x, y = get_random_coordinate(nepal)
+        generate_image(dataset, x, y, stringify_date(date), get_name_im(x, y, date), gdrive_folder, all_bands, debug)
+
+
+def download_survey(survey_csv, gdrive_folder=SURVEY_GDRIVE_FOLDER, all_bands=ALL_BANDS, nb_files=None,
+                    debug=True):
+    "Export a tile per survey point at its survey date, named {index}-{lc_code1} like the labeled 13-band tiles"
+    ee.Initialize()
+    df = pd.read_csv(survey_csv).reset_index()
+    df = df[['index', 'coord_obs_x', 'coord_obs_y', 'lc_code1', 'su_date', 'dist_m']].dropna()
+    df = df.rename(columns={'index': 'survey_id'})
+    # Points observed from too far are not in the picture
+    df = df[df['dist_m'] <= RADIUS_AROUND]
+    if nb_files is not None:
+        df = df.iloc[:nb_files]
+
+    print(f'Will download {len(df)} pictures')
+    dataset = get_collection()
+    for row in df.itertuples():
+        generate_image(dataset, row.coord_obs_x, row.coord_obs_y, row.su_date, f'{row.survey_id}-{row.lc_code1}',
+                       gdrive_folder, all_bands, debug, SURVEY_RANGE_DATE)
@@ -0,0 +1,97 @@
+from fastai.vision import *
+from fastai.vision.models.xresnet import *
+import utils as utils
+
+
+# Land cover codes of the survey that count as rice
+RICE_CODES = ['B101', 'B102', 'B103']
+
+# `label_for_rice` labels are booleans, fastai sorts them as [False, True]
+CLASSES = ['other', 'rice']
+
+# Band statistics of the EuroSat allbands dataset, used to normalize the 13-band tiles
+stats_eurosat_allbands = ([1353.73046875,
+  1117.2020263671875,
+  1041.8876953125,
+  946.5513305664062,
+  1199.1883544921875,
+  2003.0101318359375,
+  2374.01171875,
+  2301.222412109375,
+  732.1828002929688,
+  12.099513053894043,
+  1820.6893310546875,
+  1118.1998291015625,
+  2599.784912109375],
+ [30.343395233154297,
+  66.4549560546875,
+  71.52734375,
+  86.9700698852539,
+  70.47565460205078,
+  81.35286712646484,
+  97.88168334960938,
+  99.96805572509766,
+  27.891748428344727,
+  0.32882159948349,
+  92.60734558105469,
+  87.39993286132812,
+  106.57888793945312])
+
+
+def label_for_rice(name):
+    crops = (name.stem.split('-')[-1])
+
+    return crops in RICE_CODES
+
+
+def catalog_item_list(catalog_path, cls=ImageList, min_quality=None):
+    """Labeled and split item list built from a tile catalog (see `task8_preprocessing/catalog.py`)
+    instead of walking the folder and parsing every file name"""
+    df = pd.read_parquet(catalog_path)
+    df = df[df['is_rice'].notna()]
+    if min_quality is not None:
+        df = df[df['quality'] >= min_quality]
+    df = df.assign(is_valid=df['split'] == 'valid', is_rice=df['is_rice'].astype(bool)).reset_index(drop=True)
+
+    il = cls.from_df(df, Path(catalog_path).parent, cols='path')
+    il = il.split_from_df(col='is_valid')
+    return il.label_from_df(cols='is_rice')
+
+
+class NPList(ImageList):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def open(self, fn):
+        raw = np.load(str(fn))
+        x = np.swapaxes(raw, 0, 2).astype(np.float32)
+        return x
+
+
+def create_head_model(eurosat_url=None, c_in=13, n_classes=2):
+    "xresnet50 body pretrained on eurosat with a new `AdaptiveConcatPool2d` head"
+    model = xresnet50(c_in=c_in, c_out=10)
+    if eurosat_url is not None:
+        st = torch.load(eurosat_url, map_location='cpu')
+        model.load_state_dict(st)
+
+    return nn.Sequential(*list(model.children())[:-3], AdaptiveConcatPool2d(), Flatten(), nn.Linear(4096, n_classes))
+
+
+def load_weights(model, path):
+    "Load in `model` the weights saved by `learn.save`, which also holds the optimizer state unless `with_opt=False`"
+    state = torch.load(path, map_location='cpu')
+    model.load_state_dict(state.get('model', state))
+    return model
+
+
+def create_model(data, eurosat_url='data/xres7_fastai_allbandsiw5'):
+    print('Importing custom xresnet50 pretrained on eurosat')
+
+    m_new = create_head_model(eurosat_url, c_in=13, n_classes=2)
+    learn = Learner(data, m_new, metrics=[accuracy, utils.f1_score])
+    first_layer = learn.layer_groups[0][:-4]
+    second_layer = learn.layer_groups[0][-4:]
+    learn.layer_groups = [first_layer, second_layer]
+
+    return learn
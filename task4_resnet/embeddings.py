@@ -0,0 +1,188 @@
+import json
+from pathlib import Path
+import numpy as np
+import torch
+from tqdm import tqdm
+
+import serve
+from classifier import create_head_model, load_weights, stats_eurosat_allbands
+from preprocessing import open_allbands, center_crop_allbands
+
+
+# Unlabeled tiles of 25_data_download-unlabeled.ipynb
+TILES_PATH = 'data/wfp-allbands-unlabeled-b1/'
+INDEX_PATH = 'data/embeddings/'
+EUROSAT_URL = 'data/xres7_fastai_allbandsiw5'
+# Weights of a trained `create_model` learner (as saved by `learn.save`), the eurosat trunk is used when None
+WEIGHTS = None
+TILE_SIZE = 64
+BATCH_SIZE = 128
+# Random hyperplane hashing for the approximate search
+N_BITS = 16
+N_TABLES = 8
+SEED = 42
+
+
+def feature_extractor(eurosat_url=EUROSAT_URL, weights=None):
+    "The xresnet50 trunk up to the flattened `AdaptiveConcatPool2d` output, a 4096 long vector per tile"
+    model = create_head_model(eurosat_url, c_in=13)
+    if weights is not None:
+        load_weights(model, weights)
+    return model[:-1].eval()
+
+
+def load_tiles(paths, size=TILE_SIZE, stats=stats_eurosat_allbands):
+    "Center cropped, normalized (N, C, H, W) batch of 13-band .tif or .npy tiles"
+    tiles = []
+    for p in paths:
+        img = np.load(str(p)) if str(p).endswith('.npy') else open_allbands(p)
+        tiles.append(center_crop_allbands(img, size))
+    x = serve.tile_to_tensor(np.stack(tiles), 'npy')
+    mean = torch.tensor(stats[0]).view(1, -1, 1, 1)
+    std = torch.tensor(stats[1]).view(1, -1, 1, 1)
+    return (x - mean) / std
+
+
+def extract_features(model, paths, bs=BATCH_SIZE):
+    "L2 normalized float16 features of the tiles in `paths`, computed by batches"
+    device = next(model.parameters()).device
+    feats = []
+    with torch.no_grad():
+        for i in tqdm(range(0, len(paths), bs)):
+            f = model(load_tiles(paths[i:i+bs]).to(device)).float()
+            feats.append((f / f.norm(dim=1, keepdim=True).clamp_min(1e-8)).half().cpu().numpy())
+    return np.concatenate(feats) if feats else np.zeros((0, 0), dtype=np.float16)
+
+
+class EmbeddingIndex:
+    """Float16 matrix of normalized tile features with their names, stored in `path`. Scores are cosine
+    similarities. Search is exact (chunked matrix product) or approximate (random hyperplane hashing)."""
+    def __init__(self, path=INDEX_PATH, n_bits=N_BITS, n_tables=N_TABLES, seed=SEED):
+        self.path = Path(path)
+        self.n_bits, self.n_tables, self.seed = n_bits, n_tables, seed
+        self.names, self.feats = [], None
+        if (self.path/'features.npy').exists():
+            self.feats = np.load(self.path/'features.npy')
+            self.names = json.loads((self.path/'names.json').read_text())
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.tables = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def add(self, names, feats):
+        assert len(names) == len(feats)
+        if len(names) == 0:
+            return
+        self.feats = feats if self.feats is None else np.concatenate([self.feats, feats])
+        for name in names:
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+        self.tables = None
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        np.save(self.path/'features.npy', self.feats)
+        (self.path/'names.json').write_text(json.dumps(self.names))
+
+    def vector(self, name):
+        return self.feats[self.positions[name]]
+
+    def scores(self, query, chunk=65536):
+        "Cosine similarity of `query` with every tile, accumulated in float32 by chunks"
+        query = np.asarray(query, dtype=np.float32)
+        return np.concatenate([self.feats[i:i+chunk].astype(np.float32) @ query
+                               for i in range(0, len(self), chunk)])
+
+    def top_k(self, scores, idxs, k):
+        best = np.argsort(-scores)[:k]
+        return [(self.names[idxs[i]], float(scores[i])) for i in best]
+
+    def search(self, query, k=10):
+        "Exact `k` nearest tiles of `query`, as (name, score)"
+        return self.top_k(self.scores(query), np.arange(len(self)), k)
+
+    def _hash(self, feats):
+        # One `n_bits` code per table, from the signs of the projections on random hyperplanes
+        codes = (feats.astype(np.float32) @ self.planes) > 0
+        codes = codes.reshape(len(feats), self.n_tables, self.n_bits)
+        return codes @ (1 << np.arange(self.n_bits))
+
+    def build_tables(self):
+        rng = np.random.RandomState(self.seed)
+        self.planes = rng.randn(self.feats.shape[1], self.n_tables * self.n_bits).astype(np.float32)
+        codes = self._hash(self.feats)
+        self.tables = [dict() for _ in range(self.n_tables)]
+        for i, row in enumerate(codes):
+            for t, code in enumerate(row):
+                self.tables[t].setdefault(code, []).append(i)
+
+    def search_approx(self, query, k=10):
+        "Approximate `k` nearest tiles of `query`: exact scores on the tiles sharing a hash bucket with it"
+        if self.tables is None:
+            self.build_tables()
+        query = np.asarray(query, dtype=np.float32)
+        codes = self._hash(query[None])[0]
+        candidates = set()
+        for table, code in zip(self.tables, codes):
+            candidates.update(table.get(code, []))
+        idxs = np.array(sorted(candidates), dtype=np.int64)
+        if len(idxs) == 0:
+            return []
+        return self.top_k(self.feats[idxs].astype(np.float32) @ query, idxs, k)
+
+    def near_duplicates(self, threshold=0.98, chunk=1024):
+        "Pairs of tiles (name_a, name_b, score) with a cosine similarity above `threshold`"
+        feats = self.feats.astype(np.float32)
+        pairs = []
+        for i in range(0, len(self), chunk):
+            sims = feats[i:i+chunk] @ feats.T
+            rows, cols = np.nonzero(sims > threshold)
+            for r, c in zip(rows, cols):
+                if i + r < c:
+                    pairs.append((self.names[i + r], self.names[c], float(sims[r, c])))
+        return sorted(pairs, key=lambda p: -p[2])
+
+    def select_diverse(self, k, exclude=(), exclude_feats=None):
+        """`k` tiles far from each other and from the already labelled ones, picked greedily as the tile least
+        similar to every tile picked so far. Labelled tiles are given as `exclude` names when they are in the
+        index, or as `exclude_feats`, their `extract_features` (the labelled tiles are not in this index)."""
+        feats = self.feats.astype(np.float32)
+        max_sim = np.full(len(self), -np.inf, dtype=np.float32)
+        for name in exclude:
+            max_sim = np.maximum(max_sim, feats @ self.vector(name).astype(np.float32))
+        if exclude_feats is not None and len(exclude_feats):
+            exclude_feats = np.asarray(exclude_feats, dtype=np.float32)
+            for i in range(0, len(exclude_feats), 1024):
+                max_sim = np.maximum(max_sim, (feats @ exclude_feats[i:i+1024].T).max(1))
+        picked = []
+        for _ in range(min(k, len(self))):
+            i = int(np.argmin(max_sim))
+            picked.append(self.names[i])
+            max_sim = np.maximum(max_sim, feats @ feats[i])
+            max_sim[i] = np.inf
+        return picked
+
+
+def update_index(tiles_path=TILES_PATH, index_path=INDEX_PATH, eurosat_url=EUROSAT_URL, weights=WEIGHTS,
+                 bs=BATCH_SIZE):
+    "Add the tiles of `tiles_path` not yet in the index, the features of known tiles are never recomputed"
+    index = EmbeddingIndex(index_path)
+    paths = sorted(p for p in Path(tiles_path).iterdir() if p.suffix in ['.tif', '.npy'] and p.name not in index)
+    print(f'{len(index)} tiles in the index, {len(paths)} new')
+    if len(paths) == 0:
+        return index
+
+    model = feature_extractor(eurosat_url, weights)
+    if torch.cuda.is_available():
+        model = model.cuda()
+    index.add([p.name for p in paths], extract_features(model, paths, bs))
+    index.save()
+    return index
+
+
+if __name__ == '__main__':
+    update_index()
@@ -0,0 +1,121 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import torch
+from tqdm import tqdm
+
+import serve
+
+
+RASTER_PATH = 'data/nepal-13bands.tif'
+PREDICTOR_PATH = serve.PREDICTOR_PATH
+OUTPUT_PATH = 'data/nepal-crop-probabilities.tif'
+# Tiles have the size the classifier was trained on (`center_crop_allbands`)
+TILE_SIZE = 64
+# Distance between two tiles, one output pixel per tile
+STRIDE = 32
+BATCH_SIZE = 256
+# Number of tile rows and columns handled by one task, bounds the memory of a worker
+ROWS_PER_TASK = 4
+COLS_PER_TASK = 512
+WORKERS = 4
+THREADS_PER_WORKER = 1
+NODATA = -1.
+
+
+def output_profile(src, classes, stride=STRIDE, tile_size=TILE_SIZE):
+    "Profile of the probability raster: one pixel per tile, centered on the tile, one band per class"
+    n_rows = (src.height - tile_size) // stride + 1
+    n_cols = (src.width - tile_size) // stride + 1
+    offset = (tile_size - stride) / 2
+    transform = src.transform * rasterio.Affine.translation(offset, offset) * rasterio.Affine.scale(stride)
+    profile = src.profile.copy()
+    profile.update(driver='GTiff', height=n_rows, width=n_cols, count=len(classes), dtype='float32',
+                   transform=transform, nodata=NODATA, tiled=True, blockxsize=256, blockysize=256,
+                   compress='deflate', BIGTIFF='IF_SAFER')
+    profile.pop('photometric', None)
+    return profile
+
+
+def iter_tile_batches(src, row, col, n_rows, n_cols, stride=STRIDE, tile_size=TILE_SIZE, batch_size=BATCH_SIZE):
+    "Read the block covering `n_rows` x `n_cols` tiles starting at tile (`row`, `col`) and yield them by batches"
+    height = (n_rows - 1) * stride + tile_size
+    width = (n_cols - 1) * stride + tile_size
+    strip = src.read(window=Window(col * stride, row * stride, width, height))
+    # `src.read` gives (C, H, W), tiles are stored (H, W, C) by `crop_on_img_allbands`
+    strip = np.moveaxis(strip, 0, -1)
+
+    batch, valid = [], []
+    for i in range(n_rows):
+        for j in range(n_cols):
+            tile = strip[i * stride:i * stride + tile_size, j * stride:j * stride + tile_size]
+            batch.append(tile)
+            valid.append(bool(tile.any()))
+            if len(batch) == batch_size:
+                yield np.stack(batch), np.array(valid)
+                batch, valid = [], []
+    if batch:
+        yield np.stack(batch), np.array(valid)
+
+
+# Each worker process keeps its own copy of the predictor and of the opened raster
+_worker = dict()
+
+
+def _init_worker(raster_path, predictor_path, threads):
+    _worker['predictor'], _worker['meta'] = serve.load_predictor(predictor_path, threads)
+    _worker['src'] = rasterio.open(raster_path)
+
+
+def _predict_block(task):
+    row, col, n_rows, n_cols, stride, tile_size, batch_size = task
+    predictor, meta, src = _worker['predictor'], _worker['meta'], _worker['src']
+    probs = []
+    for tiles, valid in iter_tile_batches(src, row, col, n_rows, n_cols, stride, tile_size, batch_size):
+        out = np.full((len(tiles), len(meta['classes'])), NODATA, dtype=np.float32)
+        if valid.any():
+            with torch.no_grad():
+                out[valid] = predictor(serve.tile_to_tensor(tiles[valid], meta['layout'])).numpy()
+        probs.append(out)
+    # (n_rows * n_cols, n_classes) -> (n_classes, n_rows, n_cols)
+    probs = np.concatenate(probs).reshape(n_rows, n_cols, -1)
+    return row, col, np.moveaxis(probs, -1, 0)
+
+
+def generate_map(raster_path=RASTER_PATH, predictor_path=PREDICTOR_PATH, output_path=OUTPUT_PATH,
+                 stride=STRIDE, tile_size=TILE_SIZE, batch_size=BATCH_SIZE, rows_per_task=ROWS_PER_TASK,
+                 cols_per_task=COLS_PER_TASK, workers=WORKERS, threads_per_worker=THREADS_PER_WORKER):
+    """Slide the exported classifier over a 13-band raster and write a georeferenced probability map.
+    The model is the `create_model` xresnet50 exported with `serve.export_learner`. Blocks of tiles are
+    predicted by a process pool and written as soon as they come back, so memory is bounded by
+    `rows_per_task`, `cols_per_task`, `batch_size` and the number of workers, not by the raster size."""
+    _, meta = serve.load_predictor(predictor_path, threads=1)
+    with rasterio.open(raster_path) as src:
+        assert src.count == meta['channels'], f"raster has {src.count} bands, model expects {meta['channels']}"
+        profile = output_profile(src, meta['classes'], stride, tile_size)
+
+    n_rows, n_cols = profile['height'], profile['width']
+    tasks = [(row, col, min(rows_per_task, n_rows - row), min(cols_per_task, n_cols - col),
+              stride, tile_size, batch_size)
+             for row in range(0, n_rows, rows_per_task) for col in range(0, n_cols, cols_per_task)]
+    print(f'Predicting {n_rows}x{n_cols} tiles of {raster_path} in {len(tasks)} tasks')
+
+    with rasterio.open(output_path, 'w', **profile) as dst:
+        for i, name in enumerate(meta['classes']):
+            dst.set_band_description(i + 1, name)
+        dst.update_tags(stride=stride, tile_size=tile_size, predictor=str(predictor_path),
+                        classes=json.dumps(meta['classes']))
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(raster_path, predictor_path, threads_per_worker)) as pool:
+            for row, col, probs in tqdm(pool.map(_predict_block, tasks), total=len(tasks)):
+                dst.write(probs, window=Window(col, row, probs.shape[2], probs.shape[1]))
+
+    return output_path
+
+
+if __name__ == '__main__':
+    generate_map()
@@ -0,0 +1,100 @@
+from pathlib import Path
+from os import walk
+import numpy as np
+
+
+def center_crop(img, new_width=64, new_height=None):
+    "Center crop of a PIL image"
+    width = img.width
+    height = img.height
+
+    if new_height is None:
+        new_height = new_width
+
+    left = int(np.ceil((width - new_width) / 2))
+    right = width - int(np.floor((width - new_width) / 2))
+
+    top = int(np.ceil((height - new_height) / 2))
+    bottom = height - int(np.floor((height - new_height) / 2))
+
+    center_cropped_img = img.crop((left, top, right, bottom))
+
+    assert((center_cropped_img.height == new_height) and (center_cropped_img.width == new_width))
+
+    return center_cropped_img
+
+
+def open_allbands(path):
+    # skimage is slow to import, only the stages reading tifs pay for it
+    from skimage import io
+    return io.imread(str(path))
+
+
+def center_crop_allbands(img, new_width=64, new_height=None):
+    "Center crop of a (H, W, C) array, the result is a view on `img`"
+    height = img.shape[0]
+    width = img.shape[1]
+
+    if new_height is None:
+        new_height = new_width
+
+    left = int(np.ceil((width - new_width) / 2))
+    right = width - int(np.floor((width - new_width) / 2))
+
+    top = int(np.ceil((height - new_height) / 2))
+    bottom = height - int(np.floor((height - new_height) / 2))
+
+    center_cropped_img = img[top:bottom,left:right,:]
+
+    assert((center_cropped_img.shape[0] == new_height) and (center_cropped_img.shape[1] == new_width))
+
+    return center_cropped_img
+
+
+def crop_on_img_allbands(filename, path_target, size=64):
+    img = open_allbands(filename)
+    img = center_crop_allbands(img, size, size)
+    np.save(str(Path(path_target)/(filename.stem+'.npy')), img)
+    return img
+
+
+def crop_folder_allbands(path_source, path_target, size=64):
+    "Center crop every 13-band tif of `path_source` (not its subfolders) into `path_target`"
+    Path(path_target).mkdir(parents=True, exist_ok=True)
+    for r, d, f in walk(path_source):
+        print(f'In directory {r}: {len(f)} files')
+        for file in f:
+            if file.endswith('.tif'):
+                crop_on_img_allbands(Path(r)/file, path_target, size)
+        break
+
+
+def normalize_bands(x, stats, axis=-1):
+    "Normalize the bands of `x` (bands on `axis`) with per band `stats` = (means, stds)"
+    shape = [1] * x.ndim
+    shape[axis] = -1
+    mean = np.asarray(stats[0], dtype=np.float32).reshape(shape)
+    std = np.asarray(stats[1], dtype=np.float32).reshape(shape)
+    return (x.astype(np.float32) - mean) / std
+
+
+def visualize_all_bands(raw, bands=[3,2,1], min_map=0, max_map=2000, nmin=0, nmax=255):
+    "Clip the RGB bands of a (H, W, C) array and map the remaining values to the [nmin, nmax] range"
+    scale = (nmax-nmin) / (max_map-min_map)
+    seg = np.clip(raw[...,bands], min_map, max_map).astype(np.float32)
+    seg = seg * scale + nmin - min_map * scale
+    return seg.astype(int)
+
+
+def band_stats(paths):
+    "Per band (means, stds) of the (H, W, C) .npy or .tif tiles in `paths`, accumulated in float64 one tile at a time"
+    n, total, total_sq = 0, 0., 0.
+    for p in paths:
+        img = np.load(str(p)) if str(p).endswith('.npy') else open_allbands(p)
+        img = img.reshape(-1, img.shape[-1]).astype(np.float64)
+        n += len(img)
+        total = total + img.sum(0)
+        total_sq = total_sq + (img ** 2).sum(0)
+    mean = total / n
+    std = np.sqrt(np.maximum(total_sq / n - mean ** 2, 0))
+    return mean.tolist(), std.tolist()
@@ -0,0 +1,86 @@
+import sys
+import json
+import random
+from pathlib import Path
+import numpy as np
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parents[1]/'task9_srres'/'srgan_pytorch'))
+import model_utils
+import serve
+import utils as utils
+from classifier import CLASSES, create_head_model, label_for_rice, load_weights, stats_eurosat_allbands
+
+
+TILES_PATH = 'data/S2-allbands/crop/'
+# Weights of the trained `create_model` learner, `learn.save` puts them under `path/models`
+WEIGHTS = 'data/S2-allbands/crop/models/xresnet50-13bands.pth'
+OUTPUT_PATH = 'models/xresnet50-13bands-int8.pt'
+REPORT_PATH = 'models/xresnet50-13bands-int8-report.json'
+CALIB_TILES = 512
+VAL_TILES = 1024
+BATCH_SIZE = 64
+# 'x86' for the field boxes, 'qnnpack' on ARM
+BACKEND = 'x86'
+THREADS = 4
+SEED = 42
+
+
+def load_batches(paths, stats, bs=BATCH_SIZE):
+    "Normalized (x, y) batches of the .npy tiles in `paths`, labelled with `label_for_rice`"
+    mean = torch.tensor(stats[0]).view(1, -1, 1, 1)
+    std = torch.tensor(stats[1]).view(1, -1, 1, 1)
+    for i in range(0, len(paths), bs):
+        tiles = np.stack([np.load(str(p)) for p in paths[i:i+bs]])
+        x = (serve.tile_to_tensor(tiles, 'npy') - mean) / std
+        y = torch.tensor([int(label_for_rice(p)) for p in paths[i:i+bs]])
+        yield x, y
+
+
+def compare_classifiers(model, model_int8, batches):
+    "Accuracy and F1 of both models, and how often the int8 model agrees with the fp32 one"
+    preds, preds_int8, targets = [], [], []
+    with torch.no_grad():
+        for x, y in batches:
+            preds.append(model(x))
+            preds_int8.append(model_int8(x))
+            targets.append(y)
+    preds, preds_int8, targets = torch.cat(preds), torch.cat(preds_int8), torch.cat(targets)
+    return {'accuracy_fp32': (preds.argmax(1) == targets).float().mean().item(),
+            'accuracy_int8': (preds_int8.argmax(1) == targets).float().mean().item(),
+            'f1_fp32': utils.f1_score(preds, targets).item(),
+            'f1_int8': utils.f1_score(preds_int8, targets).item(),
+            'agreement': (preds.argmax(1) == preds_int8.argmax(1)).float().mean().item()}
+
+
+def main():
+    torch.set_num_threads(THREADS)
+    model = create_head_model(c_in=13, n_classes=len(CLASSES))
+    load_weights(model, WEIGHTS)
+    model.eval()
+
+    paths = sorted(Path(TILES_PATH).glob('*.npy'))
+    random.Random(SEED).shuffle(paths)
+    calib_paths, val_paths = paths[:CALIB_TILES], paths[CALIB_TILES:CALIB_TILES + VAL_TILES]
+
+    calib = (x for x, _ in load_batches(calib_paths, stats_eurosat_allbands))
+    model_int8 = model_utils.quantize_static(model, calib, BACKEND)
+
+    example = torch.rand(BATCH_SIZE, 13, 64, 64)
+    report = compare_classifiers(model, model_int8, load_batches(val_paths, stats_eurosat_allbands))
+    report.update(latency_fp32_s=model_utils.latency(model, example),
+                  latency_int8_s=model_utils.latency(model_int8, example),
+                  size_fp32_bytes=model_utils.serialized_size(model, example),
+                  size_int8_bytes=model_utils.serialized_size(model_int8, example))
+    report['speedup'] = report['latency_fp32_s'] / report['latency_int8_s']
+    print(json.dumps(report, indent=2))
+
+    # Same format as `serve.export_learner`, the int8 predictor is a drop-in for serve.py and mapping.py
+    Path(OUTPUT_PATH).parent.mkdir(parents=True, exist_ok=True)
+    serve.export_predictor(model_int8, stats_eurosat_allbands, OUTPUT_PATH, CLASSES)
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+
+
+PREDICTOR_PATH = 'models/xresnet50-13bands.pt'
+HOST = '127.0.0.1'
+PORT = 8080
+TILE_SIZE = 64
+# The first request of a micro-batch waits at most this long for others to join
+MAX_LATENCY_MS = 10
+MAX_BATCH_SIZE = 64
+THREADS = 4
+# Number of recent requests used for the latency / throughput report
+STATS_WINDOW = 10000
+
+
+# Layouts a tile can be sent in:
+#  'npy'   -> (H, W, C) raw band values, as saved by `crop_on_img_allbands` and opened by `NPList`
+#  'image' -> (H, W, C) uint8 pixels, as opened by `ImageList`
+LAYOUTS = ['npy', 'image']
+
+
+class Predictor(nn.Module):
+    "Wraps a classifier with its normalization and a softmax so the exported file is self-contained"
+    def __init__(self, model, stats):
+        super().__init__()
+        self.model = model
+        mean, std = stats
+        self.register_buffer('mean', torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1))
+        self.register_buffer('std', torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1))
+
+    def forward(self, x):
+        x = (x - self.mean) / self.std
+        return torch.softmax(self.model(x), dim=1)
+
+
+def class_names(classes):
+    "String names of the classes of a DataBunch, the `label_for_rice` labels [False, True] become `CLASSES`"
+    classes = list(classes)
+    if classes == [False, True]:
+        from classifier import CLASSES
+        return list(CLASSES)
+    return [str(c) for c in classes]
+
+
+def export_predictor(model, stats, path, classes, layout='npy', size=TILE_SIZE):
+    "Trace `model` with its `stats` into a TorchScript file that needs neither fastai nor a DataBunch"
+    assert layout in LAYOUTS, f'layout must be one of {LAYOUTS}'
+    predictor = Predictor(model.cpu().eval(), stats).eval()
+    example = torch.rand(2, len(stats[0]), size, size)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(predictor, example))
+
+    meta = {'classes': class_names(classes), 'channels': len(stats[0]), 'size': size, 'layout': layout}
+    torch.jit.save(traced, str(path), _extra_files={'meta.json': json.dumps(meta)})
+    return traced
+
+
+def export_learner(learn, path, layout='npy', size=TILE_SIZE):
+    "Export a trained fastai `Learner`, taking the normalization and classes from its data"
+    return export_predictor(learn.model, learn.data.stats, path, learn.data.classes, layout, size)
+
+
+def load_predictor(path, threads=THREADS):
+    "Load an exported predictor and run it once so the first request does not pay for the warm-up"
+    torch.set_num_threads(threads)
+    extra = {'meta.json': ''}
+    predictor = torch.jit.load(str(path), map_location='cpu', _extra_files=extra)
+    predictor.eval()
+    meta = json.loads(extra['meta.json'])
+    with torch.no_grad():
+        predictor(torch.zeros(1, meta['channels'], meta['size'], meta['size']))
+    return predictor, meta
+
+
+def tile_to_tensor(tile, layout):
+    "Convert one (H, W, C) tile, or a (N, H, W, C) stack, to the layout the model was trained on"
+    if layout == 'npy':
+        # `NPList.open` swaps the band axis with the first one, keep doing the same
+        return torch.from_numpy(np.ascontiguousarray(np.swapaxes(tile, -3, -1), dtype=np.float32))
+    tile = np.moveaxis(tile, -1, -3)
+    return torch.from_numpy(np.ascontiguousarray(tile, dtype=np.float32) / 255.)
+
+
+class MicroBatcher:
+    "Collects concurrent requests into batches bounded by `max_batch_size` and `max_latency_ms`"
+    _stop = object()
+
+    def __init__(self, predictor, max_batch_size=MAX_BATCH_SIZE, max_latency_ms=MAX_LATENCY_MS):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue = queue.Queue()
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.finished = deque(maxlen=STATS_WINDOW)
+        self.batch_sizes = deque(maxlen=STATS_WINDOW)
+        self.worker = threading.Thread(target=self._loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, x):
+        "Queue a (C, H, W) tensor, returns a `Future` holding its class probabilities"
+        future = Future()
+        self.queue.put((x, future, time.perf_counter()))
+        return future
+
+    def predict(self, xs, timeout=None):
+        futures = [self.submit(x) for x in xs]
+        return [f.result(timeout) for f in futures]
+
+    def close(self):
+        self.queue.put(self._stop)
+        self.worker.join()
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is self._stop:
+            return None
+        items = [first]
+        deadline = first[2] + self.max_latency
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._stop:
+                # Serve what we have, then stop on the next round
+                self.queue.put(self._stop)
+                break
+            items.append(item)
+        return items
+
+    def _run(self, items):
+        # Requests of different tile sizes can not share a batch
+        by_shape = dict()
+        for item in items:
+            by_shape.setdefault(tuple(item[0].shape), []).append(item)
+
+        for group in by_shape.values():
+            try:
+                with torch.no_grad():
+                    probs = self.predictor(torch.stack([x for x, _, _ in group]))
+            except Exception as e:
+                for _, future, _ in group:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for (_, future, arrived), p in zip(group, probs.tolist()):
+                future.set_result(p)
+                self.latencies.append(done - arrived)
+                self.finished.append(done)
+            self.batch_sizes.append(len(group))
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                break
+            self._run(items)
+
+    def stats(self):
+        "p50 / p99 latency (ms), mean batch size and throughput (tiles/s) over the last `STATS_WINDOW` tiles"
+        latencies = np.array(self.latencies) * 1000
+        if len(latencies) == 0:
+            return {'count': 0}
+        finished = list(self.finished)
+        span = finished[-1] - finished[0]
+        return {'count': len(latencies),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'mean_batch_size': float(np.mean(self.batch_sizes)),
+                'throughput': (len(finished) - 1) / span if span > 0 else None}
+
+
+def make_handler(batcher, meta):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, batcher.stats())
+            elif self.path == '/health':
+                self._reply(200, meta)
+            else:
+                self._reply(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            # Body is a `.npy` file with one (H, W, C) tile or a (N, H, W, C) stack of tiles
+            if self.path != '/predict':
+                self._reply(404, {'error': f'unknown path {self.path}'})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                tiles = np.load(io.BytesIO(self.rfile.read(length)), allow_pickle=False)
+                x = tile_to_tensor(tiles, meta['layout'])
+            except Exception as e:
+                self._reply(400, {'error': str(e)})
+                return
+            if x.dim() not in (3, 4) or x.shape[-3] != meta['channels']:
+                self._reply(400, {'error': f"expected (H, W, {meta['channels']}) tiles or a (N, H, W, "
+                                           f"{meta['channels']}) stack, got shape {list(tiles.shape)}"})
+                return
+            if x.dim() == 3:
+                x = x[None]
+            try:
+                probs = batcher.predict(list(x))
+            except Exception as e:
+                # TorchScript errors carry the whole traceback, the last line is the actual error
+                lines = str(e).strip().splitlines()
+                self._reply(500, {'error': f"{type(e).__name__}: {lines[-1] if lines else ''}"})
+                return
+            self._reply(200, {'classes': meta['classes'], 'probs': probs})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(predictor_path=PREDICTOR_PATH, host=HOST, port=PORT, max_batch_size=MAX_BATCH_SIZE,
+          max_latency_ms=MAX_LATENCY_MS, threads=THREADS):
+    predictor, meta = load_predictor(predictor_path, threads)
+    batcher = MicroBatcher(predictor, max_batch_size, max_latency_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, meta))
+    print(f'Serving {predictor_path} on http://{host}:{port} (POST /predict, GET /stats)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        print(json.dumps(batcher.stats()))
+
+
+def open_tile(path, layout, size):
+    "Center cropped (H, W, C) tile of a .npy / .tif file ('npy' layout) or of an image file ('image' layout)"
+    from preprocessing import open_allbands, center_crop_allbands
+    if layout == 'npy':
+        img = np.load(str(path)) if str(path).endswith('.npy') else open_allbands(path)
+    else:
+        from PIL import Image
+        img = np.asarray(Image.open(path).convert('RGB'))
+    return center_crop_allbands(img, size)
+
+
+def predict_folder(folder, output_csv, predictor_path=PREDICTOR_PATH, bs=MAX_BATCH_SIZE, threads=THREADS):
+    "Probabilities of every tile of `folder`, one row per file, written to `output_csv` without loading fastai"
+    predictor, meta = load_predictor(predictor_path, threads)
+    suffixes = ['.npy', '.tif', '.tiff'] if meta['layout'] == 'npy' else ['.png', '.jpg', '.jpeg', '.tif', '.tiff']
+    paths = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in suffixes)
+    with open(output_csv, 'w') as f:
+        f.write(','.join(['name'] + meta['classes']) + '\n')
+        for i in range(0, len(paths), bs):
+            tiles = np.stack([open_tile(p, meta['layout'], meta['size']) for p in paths[i:i+bs]])
+            with torch.no_grad():
+                probs = predictor(tile_to_tensor(tiles, meta['layout'])).numpy()
+            for p, row in zip(paths[i:i+bs], probs):
+                f.write(','.join([p.name] + [f'{v:.6f}' for v in row]) + '\n')
+    print(f'Wrote the predictions of {len(paths)} tiles to {output_csv}')
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,62 @@
+"Export a learner labelled with `label_for_rice` and run the folder and map predictions on the exported file"
+import csv
+
+import numpy as np
+import pytest
+
+pytest.importorskip('fastai')
+rasterio = pytest.importorskip('rasterio')
+
+from classifier import *
+import mapping
+import serve
+
+
+@pytest.fixture
+def predictor_path(tmp_path):
+    tiles = tmp_path/'tiles'
+    tiles.mkdir()
+    for i in range(8):
+        np.save(tiles/f'{i}-{"B101" if i % 2 else "H01"}.npy',
+                np.random.randint(0, 3000, (80, 80, 13)).astype(np.float32))
+    data = (NPList.from_folder(tiles, extensions=['.npy']).split_by_idx([0, 1]).label_from_func(label_for_rice)
+            .databunch(bs=2, num_workers=0).normalize(stats_eurosat_allbands))
+    assert data.classes == [False, True]
+
+    learn = Learner(data, nn.Sequential(nn.Conv2d(13, 2, 3), nn.AdaptiveAvgPool2d(1), Flatten()))
+    path = tmp_path/'predictor.pt'
+    serve.export_learner(learn, path)
+    return path
+
+
+def test_export_learner_class_names(predictor_path):
+    _, meta = serve.load_predictor(predictor_path, threads=1)
+    assert meta['classes'] == CLASSES
+
+
+def test_predict_folder(predictor_path, tmp_path):
+    output = tmp_path/'preds.csv'
+    serve.predict_folder(predictor_path.parent/'tiles', output, predictor_path, bs=3, threads=1)
+    with open(output) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['name'] + CLASSES
+    assert len(rows) == 9
+    assert all(abs(float(r[1]) + float(r[2]) - 1) < 1e-4 for r in rows[1:])
+
+
+def test_generate_map(predictor_path, tmp_path):
+    raster = tmp_path/'scene.tif'
+    profile = dict(driver='GTiff', width=160, height=128, count=13, dtype='float32',
+                   crs='EPSG:32644', transform=rasterio.transform.from_origin(500000, 3100000, 10, 10))
+    with rasterio.open(raster, 'w', **profile) as dst:
+        dst.write(np.random.randint(0, 3000, (13, 128, 160)).astype(np.float32))
+
+    output = tmp_path/'map.tif'
+    mapping.generate_map(raster, predictor_path, output, stride=32, batch_size=4, workers=1)
+    with rasterio.open(output) as src:
+        assert src.count == 2
+        assert list(src.descriptions) == CLASSES
+        probs = src.read()
+    valid = probs[0] != mapping.NODATA
+    assert valid.any()
+    np.testing.assert_allclose((probs[0] + probs[1])[valid], 1, atol=1e-4)
@@ -0,0 +1,55 @@
+from fastai.vision import *
+import time
+import utils as utils
+
+
+def dihedral_batch(x):
+    "The 8 dihedral variants (flips and 90 degree rotations) of a batch of square tiles, stacked as (8*N, C, H, W)"
+    assert x.shape[-1] == x.shape[-2], 'dihedral TTA needs square tiles'
+    # Transposing is a view, the 8 variants are the 4 flips of the tile and of its transpose
+    xt = x.transpose(-1, -2)
+    return torch.cat([x, x.flip(-1), x.flip(-2), x.flip(-1, -2), xt, xt.flip(-1), xt.flip(-2), xt.flip(-1, -2)])
+
+
+def dihedral_tta(model, x):
+    "Logits of `model` averaged over the 8 dihedral variants of `x`, computed in a single forward pass"
+    n = x.size(0)
+    return model(dihedral_batch(x)).view(8, n, -1).mean(0)
+
+
+class DihedralTTA(nn.Module):
+    "Wraps a classifier to always predict with dihedral TTA, can be exported with `serve.export_predictor`"
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return dihedral_tta(self.model, x)
+
+
+def get_preds(model, dl, tta=False):
+    "Predictions and targets of `model` over `dl`, with or without dihedral TTA"
+    model.eval()
+    preds, targets = [], []
+    with torch.no_grad():
+        for x, y in dl:
+            preds.append(dihedral_tta(model, x) if tta else model(x))
+            targets.append(y)
+    return torch.cat(preds), torch.cat(targets)
+
+
+def tta_report(learn, ds_type=DatasetType.Valid):
+    "Accuracy, F1 and latency of `learn` on `ds_type` without and with dihedral TTA"
+    dl = learn.dl(ds_type)
+    res = dict()
+    for name, tta in [('single', False), ('dihedral', True)]:
+        start = time.perf_counter()
+        preds, y = get_preds(learn.model, dl, tta)
+        if torch.cuda.is_available(): torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+        res[name] = {'accuracy': accuracy(preds, y).item(), 'f1': utils.f1_score(preds, y).item(),
+                     'seconds': elapsed, 'ms_per_tile': elapsed / len(y) * 1000}
+    res['accuracy_gain'] = res['dihedral']['accuracy'] - res['single']['accuracy']
+    res['f1_gain'] = res['dihedral']['f1'] - res['single']['f1']
+    res['latency_factor'] = res['dihedral']['seconds'] / res['single']['seconds']
+    return res
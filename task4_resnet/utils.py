@@ -1,14 +1,8 @@
-from fastai.vision import *
-from PIL import Image
-from matplotlib.pyplot import imshow
 from pathlib import Path
-from tqdm import tqdm
-import plotly
-import plotly.plotly as py
-import plotly.graph_objs as go
+from torch import Tensor
 
 
-def f1_score(y_pred:Tensor, y_true:Tensor,beta:float=1, eps:float=1e-9)->Rank0Tensor:
+def f1_score(y_pred:Tensor, y_true:Tensor,beta:float=1, eps:float=1e-9)->Tensor:
     "Computes the f_beta between `preds` and `targets`"
     beta2 = beta ** 2
 
@@ -22,7 +16,13 @@ def f1_score(y_pred:Tensor, y_true:Tensor,beta:float=1, eps:float=1e-9)->Rank0Te
     return res.mean()
 
 
-def get_coordinates_and_label(items, res, df, col='preds'):
+def get_coordinates_and_label(items, res, df, col='preds', catalog=None):
+    if catalog is not None:
+        # Survey ids come from the tile catalog, no need to parse the file names
+        ids = catalog.set_index(catalog['path'].map(lambda p: Path(p).name))['survey_id']
+        df.loc[ids[[Path(elt).name for elt in items]].astype(int).values, col] = res
+        return
+
     for i, elt in enumerate(items):
         id_im = int(elt.stem.split('-')[0])
         pred = res[i]
@@ -31,6 +31,7 @@ def get_coordinates_and_label(items, res, df, col='preds'):
         
         
 def get_geoblock(df, color, name, width=0.5):
+    import plotly.graph_objs as go
     return go.Scattergeo(
         locationmode = 'country names',
         lon = df['coord_obs_x'],
@@ -48,6 +49,9 @@ def get_geoblock(df, color, name, width=0.5):
         ))
 
 def plot_geo_info(dfs, names, colors, iplot=True):
+    # plotly is only needed for the maps, don't make every user of f1_score import it
+    import plotly
+    import plotly.graph_objs as go
     data = []
     for i, df in enumerate(dfs):
         data.append(get_geoblock(df, colors[i], names[i]))
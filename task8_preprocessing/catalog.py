@@ -0,0 +1,172 @@
+import os
+import re
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from skimage import io
+from tqdm import tqdm
+
+
+# Folder holding the tiles, the catalog is written next to them
+ROOT = 'data/S2-allbands/crop/'
+CATALOG_NAME = 'catalog.parquet'
+SURVEY_CSV = '../task4_labeling_preprocessing/data_analysis/point_survey_v1.csv'
+EXTENSIONS = ['.npy', '.tif', '.png', '.jpg']
+VALID_PCT = 0.2
+RICE_CODES = ['B101', 'B102', 'B103']
+# Reading every new tile to score it is the only costly part of an update
+COMPUTE_QUALITY = True
+
+COLUMNS = ['path', 'survey_id', 'coord_x', 'coord_y', 'date', 'crop_code', 'is_rice', 'group', 'split', 'quality']
+
+
+# The naming schemes used by the download and preprocessing notebooks:
+#  13 bands, labeled:  {survey_id}-{crop_code}                          1-H01.npy
+#  RGB, labeled:       [{group}-]{rice|wheat|other}_{season}_{x}_{y}_img_{n}  rice_Oct16_84-28306358_27-59084298_img_0.png
+#  unlabeled:          {x}_{y}_{date}                                   84-283063_27-590842_2017-03-01.tif
+SURVEY_NAME = re.compile(r'^(?P<survey_id>\d+)-(?P<crop_code>[A-Z]\d+)$')
+RGB_NAME = re.compile(r'^(?:\d+-)?(?P<label>rice|wheat|other)_(?P<date>[A-Za-z]+\d+)_(?P<x>\d+-\d+)_(?P<y>\d+-\d+)_img_\d+$')
+UNLABELED_NAME = re.compile(r'^(?P<x>\d+-\d+)_(?P<y>\d+-\d+)_(?P<date>.+)$')
+
+
+def get_coord(s):
+    return np.float64(s.replace('-', '.'))
+
+
+def crop_is_rice(crop_code):
+    return crop_code in RICE_CODES or crop_code == 'rice'
+
+
+def parse_tile_name(stem, survey=None):
+    "Everything the file name of a tile tells about it, completed with the `survey` row it refers to"
+    info = dict(survey_id=None, coord_x=np.nan, coord_y=np.nan, date=None, crop_code=None, is_rice=None)
+
+    m = SURVEY_NAME.match(stem)
+    if m is not None:
+        survey_id = int(m['survey_id'])
+        info.update(survey_id=survey_id, crop_code=m['crop_code'], is_rice=crop_is_rice(m['crop_code']))
+        if survey is not None and survey_id in survey.index:
+            row = survey.loc[survey_id]
+            info.update(coord_x=row['coord_obs_x'], coord_y=row['coord_obs_y'], date=row['su_date'])
+        return info
+
+    m = RGB_NAME.match(stem)
+    if m is not None:
+        # The RGB tiles carry a crop name instead of a survey code
+        info.update(coord_x=get_coord(m['x']), coord_y=get_coord(m['y']), date=m['date'], crop_code=m['label'],
+                    is_rice=crop_is_rice(m['label']))
+        return info
+
+    m = UNLABELED_NAME.match(stem)
+    if m is not None:
+        info.update(coord_x=get_coord(m['x']), coord_y=get_coord(m['y']), date=m['date'])
+    return info
+
+
+def open_tile(path):
+    path = str(path)
+    if path.endswith('.npy'):
+        return np.load(path)
+    if path.endswith('.tif'):
+        return io.imread(path)
+    return np.array(Image.open(path))
+
+
+def tile_quality(path):
+    "Fraction of pixels with at least one non-zero band, black borders and missing data score low"
+    img = open_tile(path)
+    if img.ndim == 3 and img.shape[0] < img.shape[-1]:
+        img = np.moveaxis(img, 0, -1)
+    return float(img.reshape(img.shape[0], img.shape[1], -1).any(-1).mean())
+
+
+def group_key(x, y):
+    return f'{x}_{y}'
+
+
+def split_for_group(key, valid_pct=VALID_PCT):
+    # Hash of the location rather than a random draw, so the split of a group never changes between updates
+    return 'valid' if zlib.crc32(key.encode()) % 1000 < valid_pct * 1000 else 'train'
+
+
+def list_tiles(root, extensions=EXTENSIONS):
+    "Paths of the tiles relative to `root`, only names are read so this stays cheap on large folders"
+    paths = []
+    for r, d, f in os.walk(root):
+        for file in f:
+            if os.path.splitext(file)[1] in extensions:
+                paths.append(os.path.relpath(os.path.join(r, file), root))
+    return sorted(paths)
+
+
+def assign_groups(df):
+    "Tiles taken at the same coordinates share a group, which replaces renaming them with a group index"
+    keys = [group_key(x, y) if not (np.isnan(x) or np.isnan(y)) else path
+            for path, x, y in zip(df['path'], df['coord_x'], df['coord_y'])]
+    known = df['group'].notna()
+    groups = dict(zip((k for k, kn in zip(keys, known) if kn), df.loc[known, 'group']))
+    next_group = int(df['group'].max()) + 1 if known.any() else 0
+
+    for key in keys:
+        if key not in groups:
+            groups[key] = next_group
+            next_group += 1
+    df['group'] = [groups[k] for k in keys]
+    df['split'] = [s if isinstance(s, str) else split_for_group(k) for k, s in zip(keys, df['split'])]
+    return df
+
+
+def update_catalog(root=ROOT, catalog_path=None, survey_csv=SURVEY_CSV, compute_quality=COMPUTE_QUALITY):
+    """Create the catalog of `root`, or bring an existing one up to date: new tiles are parsed and
+    added, tiles gone from the disk are dropped, existing rows (and their group / split) are kept."""
+    root = Path(root)
+    catalog_path = Path(catalog_path) if catalog_path is not None else root / CATALOG_NAME
+
+    if catalog_path.exists():
+        catalog = pd.read_parquet(catalog_path)
+    else:
+        catalog = pd.DataFrame(columns=COLUMNS)
+
+    survey = pd.read_csv(survey_csv) if survey_csv is not None and os.path.exists(survey_csv) else None
+    paths = list_tiles(root)
+    # Every tile already in the catalog is done, even when its name wasn't understood (null survey / crop
+    # fields): reading it again for its quality is what makes an update slow
+    catalog = catalog[catalog['path'].isin(paths)]
+    known = set(catalog['path'])
+    new_paths = [p for p in paths if p not in known]
+    print(f'{len(known)} tiles already in the catalog, {len(new_paths)} new')
+
+    rows = []
+    for path in tqdm(new_paths):
+        row = dict(path=path, group=np.nan, split=None, quality=np.nan)
+        row.update(parse_tile_name(Path(path).stem, survey))
+        if compute_quality:
+            row['quality'] = tile_quality(root / path)
+        rows.append(row)
+
+    if rows:
+        catalog = pd.concat([catalog, pd.DataFrame(rows, columns=COLUMNS)], ignore_index=True)
+    catalog = assign_groups(catalog.reset_index(drop=True))
+    catalog = catalog.astype({'survey_id': 'Int64', 'coord_x': 'float64', 'coord_y': 'float64',
+                              'is_rice': 'boolean', 'group': 'int64', 'quality': 'float32'})
+    catalog.to_parquet(catalog_path, index=False)
+    return catalog
+
+
+def read_catalog(catalog_path, split=None, labeled=False, min_quality=None):
+    "Load a catalog, optionally keeping a single split, labeled tiles or tiles above a quality threshold"
+    df = pd.read_parquet(catalog_path)
+    if split is not None:
+        df = df[df['split'] == split]
+    if labeled:
+        df = df[df['is_rice'].notna()]
+    if min_quality is not None:
+        df = df[df['quality'] >= min_quality]
+    return df.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    update_catalog()
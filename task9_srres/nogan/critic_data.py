@@ -0,0 +1,40 @@
+from fastai.vision import *
+from fastai.basic_train import LearnerCallback
+from collections import deque
+
+
+class GeneratedFakes(LearnerCallback):
+    """Critic data produced on the fly: the (LR) images of class `fake_idx` in every batch are replaced
+    by the output of `generator`, run by chunks of `gen_bs`. With `replay_size` > 0, a bounded cache of
+    past fakes is kept and each fake is swapped with a cached one with probability `replay_pct`."""
+    def __init__(self, learn, generator, fake_idx=0, gen_bs=8, replay_size=0, replay_pct=0.5):
+        super().__init__(learn)
+        self.generator,self.fake_idx,self.gen_bs = generator,fake_idx,gen_bs
+        self.replay = deque(maxlen=replay_size) if replay_size > 0 else None
+        self.replay_pct = replay_pct
+
+    def generate(self, x):
+        training = self.generator.training
+        self.generator.eval()
+        with torch.no_grad():
+            fakes = torch.cat([self.generator(x[i:i+self.gen_bs]) for i in range(0, len(x), self.gen_bs)])
+        self.generator.train(training)
+        return fakes
+
+    def replay_fakes(self, fakes):
+        # Older generator outputs keep the critic from forgetting what it has already learnt
+        fresh = [f.cpu() for f in fakes]
+        if len(self.replay) > 0:
+            for i in range(len(fakes)):
+                if random.random() < self.replay_pct:
+                    fakes[i] = self.replay[random.randrange(len(self.replay))].to(fakes.device)
+        self.replay.extend(fresh)
+        return fakes
+
+    def on_batch_begin(self, last_input, last_target, train, **kwargs):
+        is_fake = last_target == self.fake_idx
+        if not is_fake.any(): return
+        fakes = self.generate(last_input[is_fake])
+        if train and self.replay is not None: fakes = self.replay_fakes(fakes)
+        last_input[is_fake] = fakes
+        return {'last_input': last_input}
@@ -0,0 +1,52 @@
+from fastai.vision import *
+from fastai.callbacks.hooks import hook_outputs
+
+
+def gram_matrix(x):
+    n,c,h,w = x.size()
+    x = x.view(n, c, -1)
+    # The scaling is applied to the accumulator by the matmul kernel: no scaled copy of `x`
+    # and no overflow of the unscaled products when the features are in half precision
+    return torch.baddbmm(x.new_empty(n, c, c), x, x.transpose(1,2), beta=0, alpha=1/(c*h*w))
+
+
+class FeatureLoss(nn.Module):
+    def __init__(self, m_feat, layer_ids, layer_wgts, base_loss=F.l1_loss):
+        super().__init__()
+        # Layers after the deepest hooked one never contribute to the loss
+        self.m_feat = m_feat[:max(layer_ids)+1]
+        self.base_loss = base_loss
+        self.loss_features = [self.m_feat[i] for i in layer_ids]
+        self.hooks = hook_outputs(self.loss_features, detach=False)
+        self.wgts = layer_wgts
+        self.metric_names = ['pixel',] + [f'feat_{i}' for i in range(len(layer_ids))
+              ] + [f'gram_{i}' for i in range(len(layer_ids))]
+
+    def make_features(self, input, target):
+        """Features of `target` then `input`. The target pass runs without grad, so autograd keeps no activation
+        of it: a single pass over both batches would keep them all and backpropagate through them too."""
+        with torch.no_grad():
+            self.m_feat(target)
+            out_feat = self.hooks.stored
+        # The next pass stores new tensors in the hooks, no copy of the target features is needed
+        self.m_feat(input)
+        in_feat = self.hooks.stored
+        # Don't keep the activations alive in the hooks until the next call
+        for hook in self.hooks:
+            hook.stored = None
+        return in_feat, out_feat
+
+    def forward(self, input, target):
+        base_loss = self.base_loss
+        in_feat, out_feat = self.make_features(input, target)
+        with torch.no_grad():
+            out_grams = [gram_matrix(f_out) for f_out in out_feat]
+        self.feat_losses = [base_loss(input,target)]
+        self.feat_losses += [base_loss(f_in, f_out)*w
+                             for f_in, f_out, w in zip(in_feat, out_feat, self.wgts)]
+        self.feat_losses += [base_loss(gram_matrix(f_in), g_out)*w**2 * 5e3
+                             for f_in, g_out, w in zip(in_feat, out_grams, self.wgts)]
+        self.metrics = dict(zip(self.metric_names, self.feat_losses))
+        return sum(self.feat_losses)
+
+    def __del__(self): self.hooks.remove()
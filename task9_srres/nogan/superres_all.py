@@ -9,15 +9,12 @@ import cv2
 
 warnings.simplefilter("ignore")
 
-path = Path('/home/ubuntu/WFP_Nepal_RGB-Scale3.5_PNG/')
+IMAGES_PATH = Path('/home/ubuntu/WFP_Nepal_RGB-Scale3.5_PNG/')
+OUTPUT_PATH = IMAGES_PATH.parent/'Nepal_SR'
+# Folder of the exported generator learner
+LEARNER_PATH = Path('test')
+SIZE = 570
 
-images = ImageList.from_folder(path)
-path_test= Path('test')
-path_cropped_100 = Path('/home/ubuntu/NepalImages/cropped-100')
-
-print(f'Processing {len(images)} images.')
-
-learn = load_learner(path_test)
 
 def get_data(sz=500):
     #Give it some folder, as long as it exists, it can be empty
@@ -27,19 +24,37 @@ def get_data(sz=500):
               .databunch(bs=1).normalize(imagenet_stats, do_y=True))
     data.c = 3
     return data
-learn.data = get_data((570,570))
 
-def blur_and_sr(path):
+
+def load_sr_learner(learner_path=LEARNER_PATH, size=SIZE):
+    learn = load_learner(learner_path)
+    learn.data = get_data((size,size))
+    return learn
+
+
+def blur_and_sr(learn, path, size=SIZE):
     img= cv2.cvtColor(cv2.imread(path,-1), cv2.COLOR_BGR2RGB)
-    
+
     #3 seems to work best
     blur = cv2.GaussianBlur(img,(3,3),0)
-    blur = cv2.resize(blur,(570,570))
+    blur = cv2.resize(blur,(size,size))
     t = Image(tensor(blur/225.).permute(2,0,1).float())
     p,img_hr,b = learn.predict(t)
     return img_hr
-for image in progress_bar(images.items):
-    dest = path.parent/'Nepal_SR'/image.name
-    dest.parent.mkdir(exist_ok=True)
-    hr = blur_and_sr(image.as_posix()) 
-    cv2.imwrite(dest.as_posix(),cv2.cvtColor(image2np(hr.data*255), cv2.COLOR_RGB2BGR))   
\ No newline at end of file
+
+
+def super_resolve(images_path=IMAGES_PATH, output_path=OUTPUT_PATH, learner_path=LEARNER_PATH, size=SIZE):
+    images = ImageList.from_folder(images_path)
+    print(f'Processing {len(images)} images.')
+
+    learn = load_sr_learner(learner_path, size)
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    for image in progress_bar(images.items):
+        dest = output_path/image.name
+        hr = blur_and_sr(learn, image.as_posix(), size)
+        cv2.imwrite(dest.as_posix(),cv2.cvtColor(image2np(hr.data*255), cv2.COLOR_RGB2BGR))
+
+
+if __name__ == '__main__':
+    super_resolve()
@@ -4,6 +4,8 @@ from fastai.callbacks import *
 from fastai.utils.mem import *
 from fastai.vision.gan import *
 from torchvision.models import vgg16_bn
+from feature_loss import FeatureLoss
+from critic_data import GeneratedFakes
 
 #Change this to where your images are
 path = Path('/home/ubuntu/NepalImages')
@@ -26,15 +28,20 @@ def get_data(bs,size):
 
 bs,size=1,400
 
-
-name_gen = 'image_gen_600'
-path_gen = path/name_gen
-# shutil.rmtree(path_gen)
-path_gen.mkdir(exist_ok=True)
+# The critic sees fakes made by the generator from the LR images while it trains,
+# instead of a folder of generated images written beforehand
+name_gen = 'cropped-100'
+crit_gen_bs = 8
+# Optional cache of past fakes mixed into the critic batches, 0 to disable
+crit_replay_size = 0
+crit_replay_pct = 0.5
 
 learn=None
 gc.collect()
 
+path_cropped_100 = path/'cropped-100'
+learn_gen  = load_learner(path_cropped_100)
+
 def get_crit_data(classes, bs, size):
     src = ImageList.from_folder(path, include=classes).split_by_rand_pct(0.1, seed=42)
     ll = src.label_from_folder(classes=classes)
@@ -53,12 +60,13 @@ gc.collect()
 print("Training critic")
 data_crit = get_crit_data([name_gen, 'cropped-600'], bs=bs, size=size)
 learn_critic = create_critic_learner(data_crit, accuracy_thresh_expand)
+learn_critic.callbacks.append(GeneratedFakes(learn_critic, learn_gen.model, fake_idx=0, gen_bs=crit_gen_bs,
+                                             replay_size=crit_replay_size, replay_pct=crit_replay_pct))
 learn_critic.fit_one_cycle(6, 1e-3)
 learn_critic.save('critic-pretrained-600')
 print("Critic is done")
 
 learn_critic=None
-learn_gen=None
 gc.collect()
 
 bs = 2
@@ -67,52 +75,18 @@ data_crit = get_crit_data(['cropped_100', 'cropped_600'], bs=bs, size=size)
 learn_crit = create_critic_learner(data_crit, metrics=None).load('critic-pretrained-600')
 
 
-path_cropped_100 = path/'cropped-100'
 data_gen = get_data(bs,size)
 
 ##Feature Loss
-def gram_matrix(x):
-    n,c,h,w = x.size()
-    x = x.view(n, c, -1)
-    return (x @ x.transpose(1,2))/(c*h*w)
-
 vgg_m = vgg16_bn(True).features.cuda().eval()
 requires_grad(vgg_m, False)
 
 blocks = [i-1 for i,o in enumerate(children(vgg_m)) if isinstance(o,nn.MaxPool2d)]
-class FeatureLoss(nn.Module):
-    def __init__(self, m_feat, layer_ids, layer_wgts):
-        super().__init__()
-        self.m_feat = m_feat
-        self.loss_features = [self.m_feat[i] for i in layer_ids]
-        self.hooks = hook_outputs(self.loss_features, detach=False)
-        self.wgts = layer_wgts
-        self.metric_names = ['pixel',] + [f'feat_{i}' for i in range(len(layer_ids))
-              ] + [f'gram_{i}' for i in range(len(layer_ids))]
-
-    def make_features(self, x, clone=False):
-        self.m_feat(x)
-        return [(o.clone() if clone else o) for o in self.hooks.stored]
-    
-    def forward(self, input, target):
-        out_feat = self.make_features(target, clone=True)
-        in_feat = self.make_features(input)
-        self.feat_losses = [base_loss(input,target)]
-        self.feat_losses += [base_loss(f_in, f_out)*w
-                             for f_in, f_out, w in zip(in_feat, out_feat, self.wgts)]
-        self.feat_losses += [base_loss(gram_matrix(f_in), gram_matrix(f_out))*w**2 * 5e3
-                             for f_in, f_out, w in zip(in_feat, out_feat, self.wgts)]
-        self.metrics = dict(zip(self.metric_names, self.feat_losses))
-        return sum(self.feat_losses)
-    
-    def __del__(self): self.hooks.remove()
-
-feat_loss = FeatureLoss(vgg_m, blocks[2:5], [5,15,2])
 base_loss = F.l1_loss
+feat_loss = FeatureLoss(vgg_m, blocks[2:5], [5,15,2], base_loss=base_loss)
 ####
 
 
-learn_gen  = load_learner(path_cropped_100)
 learn_gen.data = data_gen
 learn_gen.loss_func = feat_loss
 
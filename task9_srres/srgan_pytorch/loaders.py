@@ -4,13 +4,24 @@ import os
 from PIL import Image
 import cv2
 import numpy as np
+import pandas as pd
 import random
 
 
+def list_images(root, catalog=None, split=None):
+    # A tile catalog (see task8_preprocessing/catalog.py) saves listing the folder, paths are relative to `root`
+    if catalog is None:
+        return os.listdir(root)
+    df = pd.read_parquet(catalog, columns=['path', 'split'])
+    if split is not None:
+        df = df[df['split'] == split]
+    return df['path'].tolist()
+
+
 class SatelliteDataset(Dataset):
-    def __init__(self, root, hr_patch_size, scale_factor=2):
+    def __init__(self, root, hr_patch_size, scale_factor=2, catalog=None, split=None):
         self.root = root
-        self.fnames = os.listdir(self.root)
+        self.fnames = list_images(self.root, catalog, split)
         self.hr_tfms = transforms.Compose([
                         transforms.RandomChoice([transforms.Resize(hr_patch_size),
                                                  transforms.RandomCrop(hr_patch_size)]),
@@ -59,9 +70,9 @@ class SatelliteDataset(Dataset):
 
 
 class SatelliteValDataset(Dataset):
-    def __init__(self, root, hr_patch_size, scale_factor=2):
+    def __init__(self, root, hr_patch_size, scale_factor=2, catalog=None, split=None):
         self.root = root
-        self.fnames = os.listdir(self.root)
+        self.fnames = list_images(self.root, catalog, split)
         self.hr_tfms = transforms.Compose([transforms.Resize(hr_patch_size)])
         lr_patch_size = (hr_patch_size[0] // scale_factor, hr_patch_size[1] // scale_factor)
 
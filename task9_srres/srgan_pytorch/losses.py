@@ -4,17 +4,18 @@ from torch import nn
 
 
 class ContentLoss(nn.Module):
-    def __init__(self, until, distance='l2'):
+    def __init__(self, until, distance='l2', pretrained=True):
         super().__init__()
 
         self.lid = until
-        self.vgg = models.vgg19(pretrained=True).features
+        self.vgg = models.vgg19(pretrained=pretrained).features
+
+        self.vgg = nn.Sequential(*list(self.vgg.children())[:until+1])
 
         # No need of gradients
-        for module in self.vgg.modules():
-            module.requires_grad = False
+        for param in self.vgg.parameters():
+            param.requires_grad = False
 
-        self.vgg = nn.Sequential(*list(self.vgg.children())[:until+1])
         if distance == 'l1':
             self.loss = nn.L1Loss()
         elif distance == 'l2':
@@ -23,8 +24,10 @@ class ContentLoss(nn.Module):
             raise NotImplementedError()
 
     def forward(self, reconstructed, reference):
+        # No graph for the reference pass, a single pass over both batches would keep its activations
+        with torch.no_grad():
+            ref_feats = self.vgg(reference)
         rec_feats = self.vgg(reconstructed)
-        ref_feats = self.vgg(reference)
 
         b, c, h, w = ref_feats.shape
         loss_val = self.loss(rec_feats, ref_feats)
@@ -0,0 +1,34 @@
+import torch
+import torch.nn.functional as F
+
+
+def psnr(fake, real, max_val=1.0):
+    "Mean PSNR in dB of a batch of images in [0, max_val]"
+    mse = ((fake.clamp(0, max_val) - real) ** 2).flatten(1).mean(1)
+    return (10 * torch.log10(max_val ** 2 / mse.clamp_min(1e-10))).mean()
+
+
+def gaussian_window(size, sigma, channels, device=None, dtype=torch.float32):
+    coords = torch.arange(size, dtype=dtype, device=device) - size // 2
+    g = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    g = g / g.sum()
+    return (g[:, None] * g[None, :]).expand(channels, 1, size, size).contiguous()
+
+
+def ssim(fake, real, max_val=1.0, window_size=11, sigma=1.5):
+    "Mean SSIM of a batch of images in [0, max_val], computed with a gaussian window on every channel"
+    channels = real.size(1)
+    window = gaussian_window(window_size, sigma, channels, real.device, real.dtype)
+    fake = fake.clamp(0, max_val)
+
+    def blur(x):
+        return F.conv2d(x, window, groups=channels)
+
+    mu_x, mu_y = blur(fake), blur(real)
+    sigma_x = blur(fake * fake) - mu_x ** 2
+    sigma_y = blur(real * real) - mu_y ** 2
+    sigma_xy = blur(fake * real) - mu_x * mu_y
+
+    c1, c2 = (0.01 * max_val) ** 2, (0.03 * max_val) ** 2
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+    return ssim_map.mean()
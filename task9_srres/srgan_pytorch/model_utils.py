@@ -1,5 +1,15 @@
+import contextlib
+import copy
+import io
+import statistics
+import time
+import torch
 from torch import nn
 from torch.nn import init
+from torch.utils.checkpoint import checkpoint
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from torch.fx.experimental.optimization import fuse
 
 
 def w_init(blocks, stdev=0.02):
@@ -19,3 +29,81 @@ def g_init(blocks, mean=1.0, stdev=0.02):
             if isinstance(module, nn.BatchNorm2d):
                 init.normal_(module.weight, mean=mean, std=stdev)
 
+
+@contextlib.contextmanager
+def frozen_bn_stats(modules):
+    "BatchNorms of `modules` normalize with the batch statistics but don't update their running ones"
+    bns = [m for module in modules for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    saved = [(bn.momentum, bn.num_batches_tracked.clone() if bn.num_batches_tracked is not None else None)
+             for bn in bns]
+    for bn in bns:
+        bn.momentum = 0.
+    try:
+        yield
+    finally:
+        for bn, (momentum, tracked) in zip(bns, saved):
+            bn.momentum = momentum
+            if tracked is not None:
+                bn.num_batches_tracked.copy_(tracked)
+
+
+def checkpoint_sequential(modules, segments, x):
+    """Run `modules` one after the other on `x`, split in `segments` chunks whose activations are not kept
+    but recomputed during the backward pass. The recomputation doesn't update the BatchNorm running statistics
+    a second time."""
+    modules = list(modules)
+    bounds = [round(i * len(modules) / segments) for i in range(segments + 1)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        segment, calls = modules[start:end], [0]
+
+        def run(z, segment=segment, calls=calls):
+            # The first call is the forward pass, the next ones are recomputations
+            calls[0] += 1
+            with frozen_bn_stats(segment) if calls[0] > 1 else contextlib.nullcontext():
+                for module in segment:
+                    z = module(z)
+            return z
+        x = checkpoint(run, x, use_reentrant=False)
+    return x
+
+
+def fold_bn(model):
+    """Copy of `model` in eval mode where every BatchNorm2d directly following a Conv2d is folded into
+    the convolution weights. BatchNorms placed before their convolution (`ResBlock.bn1`, `mid_bn`) are kept."""
+    return fuse(copy.deepcopy(model).eval())
+
+
+def quantize_static(model, calib_batches, backend='x86'):
+    """Static int8 quantization of `model`: BatchNorms are folded, observers are calibrated on
+    `calib_batches` (an iterable of input tensors) and the model is converted for CPU inference"""
+    torch.backends.quantized.engine = backend
+    model = fold_bn(model)
+    calib_batches = iter(calib_batches)
+    first = next(calib_batches)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (first,))
+    with torch.no_grad():
+        prepared(first)
+        for x in calib_batches:
+            prepared(x)
+    return convert_fx(prepared)
+
+
+def serialized_size(model, example):
+    "Size in bytes of `model` saved as TorchScript"
+    buffer = io.BytesIO()
+    with torch.no_grad():
+        torch.jit.save(torch.jit.trace(model, example), buffer)
+    return buffer.tell()
+
+
+def latency(model, example, repeat=20, warmup=3):
+    "Median seconds of a forward pass of `model` on `example`"
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(example)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(example)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
@@ -41,10 +41,14 @@ class ConvBNLRelu(nn.Module):
 
 
 class GeneratorBNFirst(nn.Module):
-    def __init__(self, in_chan, out_chan, n_planes=64, n_blocks=16, upscale=4):
+    """`checkpoint_segments` > 0 trades compute for memory during training: the residual blocks are split in
+    that many segments and their activations are recomputed in the backward pass instead of being kept"""
+    def __init__(self, in_chan, out_chan, n_planes=64, n_blocks=16, upscale=4, checkpoint_segments=0):
         assert upscale in [2, 4], 'Only supports scaling the image by either 2 or 4'
+        assert 0 <= checkpoint_segments <= n_blocks, 'At most one checkpoint segment per residual block'
         super().__init__()
         self.upscale = upscale
+        self.checkpoint_segments = checkpoint_segments
         self.first_conv = nn.Conv2d(in_chan, n_planes, 9, 1, 4)
         model_utils.w_init([self.first_conv])
         self.first_prelu = nn.PReLU()
@@ -82,7 +86,10 @@ class GeneratorBNFirst(nn.Module):
 
     def forward(self, x):
         z = self.first_prelu(self.first_conv(x))
-        trunk = self.B(z)
+        if self.training and self.checkpoint_segments > 0 and torch.is_grad_enabled():
+            trunk = model_utils.checkpoint_sequential(self.B, self.checkpoint_segments, z)
+        else:
+            trunk = self.B(z)
         trunk = self.mid_conv(self.mid_bn(trunk))
         # The giant skip connection
         trunk = trunk + z
@@ -94,8 +101,11 @@ class GeneratorBNFirst(nn.Module):
 
 
 class Discriminator(nn.Module):
-    def __init__(self, n_planes, image_dims, neg_slope=0.2, sigmoid=True):
+    "`checkpoint_segments` > 0 recomputes the activations of `layer1` to `layer7` in that many segments"
+    def __init__(self, n_planes, image_dims, neg_slope=0.2, sigmoid=True, checkpoint_segments=0):
+        assert 0 <= checkpoint_segments <= 7, 'At most one checkpoint segment per layer'
         super().__init__()
+        self.checkpoint_segments = checkpoint_segments
 
         self.first_conv = nn.Conv2d(3, n_planes, 3, 1, 1)
         model_utils.w_init([self.first_conv])
@@ -116,13 +126,12 @@ class Discriminator(nn.Module):
         x = self.first_conv(x)
         x = self.lrelu(x)
 
-        x = self.layer1(x)
-        x = self.layer2(x)
-        x = self.layer3(x)
-        x = self.layer4(x)
-        x = self.layer5(x)
-        x = self.layer6(x)
-        x = self.layer7(x)
+        layers = [self.layer1, self.layer2, self.layer3, self.layer4, self.layer5, self.layer6, self.layer7]
+        if self.training and self.checkpoint_segments > 0 and torch.is_grad_enabled():
+            x = model_utils.checkpoint_sequential(layers, self.checkpoint_segments, x)
+        else:
+            for layer in layers:
+                x = layer(x)
 
         # Flatten
         x = x.view(x.size(0), -1)
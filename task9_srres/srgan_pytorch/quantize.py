@@ -0,0 +1,72 @@
+import json
+import itertools
+import torch
+from torch.utils.data import DataLoader
+import models
+import loaders
+import metrics
+import model_utils
+
+
+G_WEIGHTS = '01-weights/01-G.pth'
+OUTPUT_PATH = '01-weights/01-G-int8.pt'
+REPORT_PATH = '01-weights/01-G-int8-report.json'
+CALIB_IMAGES_ROOT = 'data/train'
+VAL_IMAGES_ROOT = 'data/val'
+HR_PATCH = (512, 512)
+SCALE = 2
+BATCH_SIZE = 4
+CALIB_BATCHES = 32
+VAL_BATCHES = 16
+WORKERS = 4
+# 'x86' for the field boxes, 'qnnpack' on ARM
+BACKEND = 'x86'
+THREADS = 4
+
+
+def lr_batches(root, n_batches, shuffle):
+    ds = loaders.SatelliteValDataset(root, HR_PATCH, scale_factor=SCALE)
+    dl = DataLoader(ds, BATCH_SIZE, shuffle=shuffle, num_workers=WORKERS)
+    return itertools.islice(dl, n_batches)
+
+
+def compare_generators(G, G_int8, batches):
+    "PSNR of both generators against the HR images, and of the int8 output against the fp32 one"
+    psnr_fp32, psnr_int8, psnr_agreement = [], [], []
+    with torch.no_grad():
+        for lrs, hrs in batches:
+            fake = G(lrs)
+            fake_int8 = G_int8(lrs)
+            psnr_fp32.append(metrics.psnr(fake, hrs).item())
+            psnr_int8.append(metrics.psnr(fake_int8, hrs).item())
+            psnr_agreement.append(metrics.psnr(fake_int8, fake.clamp(0, 1)).item())
+    n = len(psnr_fp32)
+    return {'psnr_fp32': sum(psnr_fp32) / n, 'psnr_int8': sum(psnr_int8) / n,
+            'psnr_int8_vs_fp32': sum(psnr_agreement) / n}
+
+
+def main():
+    torch.set_num_threads(THREADS)
+    G = models.GeneratorBNFirst(3, 3, upscale=SCALE)
+    G.load_state_dict(torch.load(G_WEIGHTS, map_location='cpu'))
+    G.eval()
+
+    calib = (lrs for lrs, _ in lr_batches(CALIB_IMAGES_ROOT, CALIB_BATCHES, shuffle=True))
+    G_int8 = model_utils.quantize_static(G, calib, BACKEND)
+
+    example = torch.rand(1, 3, HR_PATCH[0] // SCALE, HR_PATCH[1] // SCALE)
+    report = compare_generators(G, G_int8, lr_batches(VAL_IMAGES_ROOT, VAL_BATCHES, shuffle=False))
+    report.update(latency_fp32_s=model_utils.latency(G, example), latency_int8_s=model_utils.latency(G_int8, example),
+                  size_fp32_bytes=model_utils.serialized_size(G, example),
+                  size_int8_bytes=model_utils.serialized_size(G_int8, example))
+    report['speedup'] = report['latency_fp32_s'] / report['latency_int8_s']
+    print(json.dumps(report, indent=2))
+
+    with torch.no_grad():
+        torch.jit.save(torch.jit.trace(G_int8, example), OUTPUT_PATH)
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
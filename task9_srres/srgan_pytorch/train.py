@@ -6,23 +6,38 @@ import dill
 import models
 import losses
 import loaders
+import metrics
 from torch.utils.data import DataLoader
 import csv
 from tensorboardX import SummaryWriter
 import os
+import time
+import contextlib
+import queue
+import threading
+from collections import defaultdict
+import numpy as np
 from tqdm import tqdm
 
 
 DEVICE = 'cuda'
 EPOCHS = 2000
 TRAIN_BATCH_SIZE = 2
-VALID_BATCH_SIZE = 1
+VALID_BATCH_SIZE = 16
 TRAIN_IMAGES_ROOT = 'data/train'
 VAL_IMAGES_ROOT = 'data/val'
+# Tile catalogs of the train / val folders, listing the folders when None
+TRAIN_CATALOG = None
+VAL_CATALOG = None
 WORKERS = 8
 HR_PATCH = (512, 512)
 SCALE = 2
 VGG_FEATURE_LAYER = 34
+# Activation checkpointing, 0 keeps every activation. The generator residual trunk (16 blocks) and the
+# discriminator layers (7) are split in that many segments recomputed during the backward pass:
+# less memory for larger HR_PATCH / TRAIN_BATCH_SIZE, at the cost of a slower step
+G_CHECKPOINT_SEGMENTS = 0
+D_CHECKPOINT_SEGMENTS = 0
 LR_DECAY = 0.5
 LR_STEP = 500
 LR_G = 1e-4
@@ -35,18 +50,30 @@ LOAD_CHECKPOINT = None
 TENSORBOARD_LOGDIR = f'{EXP_NO:02d}-tboard'
 END_EPOCH_SAVE_SAMPLES_PATH = f'{EXP_NO:02d}-epoch_end_samples'
 WEIGHTS_SAVE_PATH = f'{EXP_NO:02d}-weights'
-BATCHES_TO_SAVE = 3
+SAMPLES_TO_SAVE = 3
+# Samples waiting to be written by the background writer, bounds the memory they hold
+SAMPLES_QUEUE_SIZE = 8
+# Opt-in profiling of a window of training steps, nothing is recorded or timed when False
+PROFILE = False
+PROFILE_EPOCH = 1
+PROFILE_WAIT = 5
+PROFILE_WARMUP = 2
+PROFILE_ACTIVE = 5
+PROFILE_ROW_LIMIT = 30
+PROFILE_LOGDIR = os.path.join(TENSORBOARD_LOGDIR, 'profile')
 
 
 # Too many losses to keep track of
 # Put everyone in a single place
 class BookKeeping:
-    def __init__(self, tensorboard_log_path=None, suffix=''):
+    def __init__(self, tensorboard_log_path=None, suffix='', metric_names=()):
         self.loss_names = ['content', 'mse', 'adversarial',
-                           'generator', 'discriminator']
+                           'generator', 'discriminator'] + list(metric_names)
         self.genesis()
         # Initialize tensorboard objects
         self.tboard = dict()
+        self.tensorboard_log_path = tensorboard_log_path
+        self.suffix = suffix
         if tensorboard_log_path is not None:
             if not os.path.exists(tensorboard_log_path):
                 os.mkdir(tensorboard_log_path)
@@ -56,12 +83,16 @@ class BookKeeping:
     def genesis(self):
         self.losses = {key: 0 for key in self.loss_names}
         self.count = 0
+        self.timings = defaultdict(list)
 
     def update(self, **kwargs):
         for key in kwargs:
             self.losses[key] += kwargs[key]
         self.count += 1
 
+    def update_timing(self, name, seconds):
+        self.timings[name].append(seconds)
+
     def reset(self):
         self.genesis()
 
@@ -76,6 +107,13 @@ class BookKeeping:
         for key in self.loss_names:
             self.tboard[key].add_scalar(key, avg_losses[key], epoch)
 
+        # Timings only exist when profiling, their writers are created on first use
+        for key, values in self.timings.items():
+            if key not in self.tboard:
+                self.tboard[key] = SummaryWriter(os.path.join(self.tensorboard_log_path, key + '_' + self.suffix))
+            self.tboard[key].add_histogram(key, np.array(values), epoch)
+            self.tboard[key].add_scalar(key + '_total', sum(values), epoch)
+
 
 def save_checkpoint(epoch, generator, discriminator, best_metrics, optimizer_G, lr_scheduler_G,
                     optimizer_D, lr_scheduler_D, filename='checkpoint.pth.tar'):
@@ -117,12 +155,104 @@ def save_images(path, lr_images, fake_hr, hr_images, epoch, batchid):
         image.save(f'{images_path}/{batchid}_{i:02d}_hr.jpg', 'JPEG')
 
 
-def train(G, D, trn_dl, epoch, epochs, content_loss, MSE, adv_loss, opt_G, opt_D, train_losses):
+def region(name):
+    # Labelled span in the profiler trace, free when not profiling
+    return torch.profiler.record_function(name) if PROFILE else contextlib.nullcontext()
+
+
+def timed_batches(loader, bookkeeping):
+    # Yield the batches of `loader`, recording how long the loop waited for each of them
+    batches = iter(loader)
+    while True:
+        start = time.perf_counter()
+        with region('data_loader'):
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+        bookkeeping.update_timing('data_wait', time.perf_counter() - start)
+        yield batch
+
+
+def add_module_regions(nets):
+    # Label the forward of every top level module of the nets in the profiler trace
+    def pre_hook(module, inputs):
+        module._profile_region = torch.profiler.record_function(module._profile_name)
+        module._profile_region.__enter__()
+
+    def hook(module, inputs, output):
+        module._profile_region.__exit__(None, None, None)
+
+    handles = []
+    for net_name, net in nets.items():
+        for name, module in net.named_children():
+            module._profile_name = f'{net_name}.{name}'
+            handles += [module.register_forward_pre_hook(pre_hook), module.register_forward_hook(hook)]
+    return handles
+
+
+def make_profiler(G, D):
+    if not os.path.exists(PROFILE_LOGDIR):
+        os.makedirs(PROFILE_LOGDIR)
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if DEVICE == 'cuda':
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    # Chrome traces, readable by chrome://tracing and the tensorboard profiler plugin
+    write_trace = torch.profiler.tensorboard_trace_handler(PROFILE_LOGDIR)
+
+    def on_trace_ready(prof):
+        write_trace(prof)
+        averages = prof.key_averages()
+        with open(os.path.join(PROFILE_LOGDIR, f'{EXP_NO:02d}-step{prof.step_num:05d}-ops.txt'), 'w') as f:
+            f.write(averages.table(sort_by='self_cpu_time_total', row_limit=PROFILE_ROW_LIMIT))
+            f.write('\n')
+            f.write(averages.table(sort_by='self_cpu_memory_usage', row_limit=PROFILE_ROW_LIMIT))
+
+    profiler = torch.profiler.profile(activities=activities,
+                                      schedule=torch.profiler.schedule(wait=PROFILE_WAIT, warmup=PROFILE_WARMUP,
+                                                                       active=PROFILE_ACTIVE, repeat=1),
+                                      on_trace_ready=on_trace_ready, record_shapes=True, profile_memory=True)
+    profiler.module_handles = add_module_regions({'G': G, 'D': D})
+    return profiler
+
+
+class ImageWriter:
+    # Writes the samples from a background thread so the epoch does not wait on JPEG encoding
+    def __init__(self, path, maxsize=SAMPLES_QUEUE_SIZE):
+        self.path = path
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            # A failed save must not stop the thread, `save` would then block forever on the full queue
+            try:
+                save_images(self.path, *item)
+            except Exception as e:
+                print(f'Could not save the samples of epoch {item[3]}, batch {item[4]}: {e!r}')
+
+    def save(self, lr_images, fake_hr, hr_images, epoch, batchid):
+        # Copies, so the queued samples do not keep the whole batch alive
+        self.queue.put((lr_images.to('cpu', copy=True), fake_hr.to('cpu', copy=True), hr_images.to('cpu', copy=True),
+                        epoch, batchid))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def train(G, D, trn_dl, epoch, epochs, content_loss, MSE, adv_loss, opt_G, opt_D, train_losses, profiler=None):
     # Set the nets into training mode
     G.train()
     D.train()
 
-    t_pbar = tqdm(trn_dl, desc=pbar_desc('train', epoch, epochs, 0.0))
+    batches = timed_batches(trn_dl, train_losses) if PROFILE else trn_dl
+    t_pbar = tqdm(batches, total=len(trn_dl), desc=pbar_desc('train', epoch, epochs, 0.0))
     for lr_imgs, hr_imgs in t_pbar:
 
         # Send the images onto the appropriate device
@@ -133,44 +263,55 @@ def train(G, D, trn_dl, epoch, epochs, content_loss, MSE, adv_loss, opt_G, opt_D
         for param in D.parameters():
             param.requires_grad = False
 
-        fake_imgs = G(lr_imgs)
-        cont_loss = content_loss(fake_imgs, hr_imgs)
+        with region('generator_forward'):
+            fake_imgs = G(lr_imgs)
+        with region('content_loss'):
+            cont_loss = content_loss(fake_imgs, hr_imgs)
         mse_loss = MSE(fake_imgs, hr_imgs)
         # Get predictions from discriminator
-        d_fake_preds = D(fake_imgs)
+        with region('discriminator_on_fake_for_G'):
+            d_fake_preds = D(fake_imgs)
         # Train the generator to generate fake images
         # such that the discriminator recognizes as real
         g_adv_loss = adv_loss(d_fake_preds, True)
 
         g_loss = CONTENT_LOSS_WEIGHT * cont_loss + MSE_LOSS_WEIGHT * mse_loss + ADVERSARIAL_LOSS_WEIGHT * g_adv_loss
         opt_G.zero_grad()
-        g_loss.backward()
+        with region('generator_backward'):
+            g_loss.backward()
         opt_G.step()
 
         # Unfreeze discriminator, train only the discriminator
         for param in D.parameters():
             param.requires_grad = True
 
-        d_fake_preds = D(fake_imgs.detach())  # detach to avoid backprop into G
-        d_real_preds = D(hr_imgs)
+        with region('discriminator_on_fake'):
+            d_fake_preds = D(fake_imgs.detach())  # detach to avoid backprop into G
+        with region('discriminator_on_real'):
+            d_real_preds = D(hr_imgs)
 
         d_loss = adv_loss(d_fake_preds, False) + adv_loss(d_real_preds, True)
         opt_D.zero_grad()
-        d_loss.backward()
+        with region('discriminator_backward'):
+            d_loss.backward()
         opt_D.step()
 
+        if profiler is not None:
+            profiler.step()
+
         t_pbar.set_description(pbar_desc('train', epoch, EPOCHS, g_loss.item()))
         train_losses.update(content=cont_loss.item(), mse=mse_loss.item(), adversarial=g_adv_loss.item(),
                             generator=g_loss.item(), discriminator=d_loss.item())
 
 
-def evaluate(G, D, val_dl, epoch, epochs, content_loss, MSE, adv_loss, val_losses, best_val_loss):
+@torch.no_grad()
+def evaluate(G, D, val_dl, epoch, epochs, content_loss, MSE, adv_loss, val_losses, best_val_loss, image_writer=None):
     # Set the nets into evaluation mode
     G.eval()
     D.eval()
 
     v_pbar = tqdm(val_dl, desc=pbar_desc('valid', epoch, epochs, 0.0))
-    for lr_imgs, hr_imgs in v_pbar:
+    for i, (lr_imgs, hr_imgs) in enumerate(v_pbar):
         lr_imgs = lr_imgs.to(DEVICE)
         hr_imgs = hr_imgs.to(DEVICE)
 
@@ -186,15 +327,21 @@ def evaluate(G, D, val_dl, epoch, epochs, content_loss, MSE, adv_loss, val_losse
         d_loss = adv_loss(d_fake_preds, False) + adv_loss(d_real_preds, True)
 
         val_losses.update(content=cont_loss.item(), mse=mse_loss.item(), adversarial=g_adv_loss.item(),
-                          generator=g_loss.item(), discriminator=d_loss.item())
+                          generator=g_loss.item(), discriminator=d_loss.item(),
+                          psnr=metrics.psnr(fake_imgs, hr_imgs).item(), ssim=metrics.ssim(fake_imgs, hr_imgs).item())
         v_pbar.set_description(pbar_desc('valid', epoch, EPOCHS, g_loss.item()))
 
+        # Save real vs fake samples of the first batch for quality inspection
+        if i == 0 and image_writer is not None:
+            n = SAMPLES_TO_SAVE
+            image_writer.save(lr_imgs[:n], fake_imgs[:n], hr_imgs[:n], epoch, 0)
+
     # Save best model weights
     avg_val_losses = val_losses.get_avg_losses()
     avg_val_loss = avg_val_losses['generator']
     avg_disval_loss = avg_val_losses['discriminator']
     if avg_val_loss < best_val_loss:
-        best_val_loss = g_loss.item()
+        best_val_loss = avg_val_loss
         torch.save(G.state_dict(), f'{WEIGHTS_SAVE_PATH}/{EXP_NO:02d}-G_epoch-{epoch:04d}_total-loss-{avg_val_loss:.3f}.pth')
         torch.save(D.state_dict(), f'{WEIGHTS_SAVE_PATH}/{EXP_NO:02d}-D_epoch-{epoch:04d}_total-loss-{avg_disval_loss:.3f}.pth')
 
@@ -202,21 +349,21 @@ def evaluate(G, D, val_dl, epoch, epochs, content_loss, MSE, adv_loss, val_losse
 
 
 def main():
-    trn_ds = loaders.SatelliteDataset(TRAIN_IMAGES_ROOT, HR_PATCH, scale_factor=SCALE)
+    trn_ds = loaders.SatelliteDataset(TRAIN_IMAGES_ROOT, HR_PATCH, scale_factor=SCALE, catalog=TRAIN_CATALOG)
     trn_dl = DataLoader(trn_ds, TRAIN_BATCH_SIZE, shuffle=True, num_workers=WORKERS)
 
-    val_ds = loaders.SatelliteValDataset(VAL_IMAGES_ROOT, HR_PATCH, scale_factor=SCALE)
+    val_ds = loaders.SatelliteValDataset(VAL_IMAGES_ROOT, HR_PATCH, scale_factor=SCALE, catalog=VAL_CATALOG)
     val_dl = DataLoader(val_ds, VALID_BATCH_SIZE, shuffle=False, num_workers=WORKERS)
     start_epoch = 1
     best_val_loss = float('inf')
 
     # Generator
-    G = models.GeneratorBNFirst(3, 3, upscale=SCALE)
+    G = models.GeneratorBNFirst(3, 3, upscale=SCALE, checkpoint_segments=G_CHECKPOINT_SEGMENTS)
     opt_G = optim.Adam(G.parameters(), lr=LR_G)
     sched_G = optim.lr_scheduler.StepLR(opt_G, LR_STEP, gamma=LR_DECAY)
 
     # Discriminator
-    D = models.Discriminator(48, HR_PATCH[0], sigmoid=True)
+    D = models.Discriminator(48, HR_PATCH[0], sigmoid=True, checkpoint_segments=D_CHECKPOINT_SEGMENTS)
     opt_D = optim.Adam(D.parameters(), lr=LR_D)
     sched_D = optim.lr_scheduler.StepLR(opt_D, LR_STEP, gamma=LR_DECAY)
 
@@ -250,36 +397,41 @@ def main():
     MSE.to(DEVICE)
 
     train_losses = BookKeeping(TENSORBOARD_LOGDIR, suffix='trn')
-    val_losses = BookKeeping(TENSORBOARD_LOGDIR, suffix='val')
-
-    for epoch in range(start_epoch, EPOCHS + 1):
-
-        # Training loop
-        train(G, D, trn_dl, epoch, EPOCHS, content_loss, MSE, adv_loss, opt_G, opt_D, train_losses)
-
-        # Validation loop
-        best_val_loss = evaluate(G, D, val_dl, epoch, EPOCHS, content_loss, MSE, adv_loss, val_losses, best_val_loss)
-
-        sched_G.step()
-        sched_D.step()
-
-        save_checkpoint(epoch, G, D, None, opt_G, sched_G, opt_D, sched_D)
-
-        train_losses.update_tensorboard(epoch)
-        val_losses.update_tensorboard(epoch)
-
-        # Reset all loss for a new epoch
-        train_losses.reset()
-        val_losses.reset()
-
-        # Save real vs fake samples for quality inspection
-        generator = iter(val_dl)
-        for j in range(BATCHES_TO_SAVE):
-            lrs, hrs = next(generator)
-            fakes = G(lrs.to(DEVICE))
-
-            # Save samples at the end
-            save_images(END_EPOCH_SAVE_SAMPLES_PATH, lrs.detach().cpu(), fakes.detach().cpu(), hrs, epoch, j)
+    val_losses = BookKeeping(TENSORBOARD_LOGDIR, suffix='val', metric_names=['psnr', 'ssim'])
+    image_writer = ImageWriter(END_EPOCH_SAVE_SAMPLES_PATH)
+
+    try:
+        for epoch in range(start_epoch, EPOCHS + 1):
+
+            # Training loop
+            profiler = make_profiler(G, D) if PROFILE and epoch == PROFILE_EPOCH else None
+            with profiler if profiler is not None else contextlib.nullcontext():
+                train(G, D, trn_dl, epoch, EPOCHS, content_loss, MSE, adv_loss, opt_G, opt_D, train_losses, profiler)
+            if profiler is not None:
+                for handle in profiler.module_handles:
+                    handle.remove()
+
+            # Validation loop
+            start = time.perf_counter()
+            best_val_loss = evaluate(G, D, val_dl, epoch, EPOCHS, content_loss, MSE, adv_loss, val_losses,
+                                     best_val_loss, image_writer)
+            if PROFILE:
+                val_losses.update_timing('evaluate', time.perf_counter() - start)
+
+            sched_G.step()
+            sched_D.step()
+
+            save_checkpoint(epoch, G, D, None, opt_G, sched_G, opt_D, sched_D)
+
+            train_losses.update_tensorboard(epoch)
+            val_losses.update_tensorboard(epoch)
+
+            # Reset all loss for a new epoch
+            train_losses.reset()
+            val_losses.reset()
+    finally:
+        # The writer thread is a daemon, flush the queued samples even when training crashes
+        image_writer.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,176 @@
+"""Command line entry point of the pipeline stages.
+
+    wfp download --survey data/survey.csv --folder wfp-allbands-b1
+    wfp crop data/wfp-allbands-b1 data/wfp-allbands-b1-64 --size 64
+    wfp stats data/wfp-allbands-b1-64
+    wfp train-sr --train-root data/train --val-root data/val --epochs 100
+    wfp super-resolve data/Nepal_RGB data/Nepal_SR --learner test
+    wfp classify data/wfp-allbands-b1-64 preds.csv --predictor models/xresnet50-13bands.pt
+    wfp map data/nepal-13bands.tif data/nepal-crop-probabilities.tif
+
+Only argparse is imported here. Every stage lives in its own folder and imports its frameworks
+(fastai, torch, rasterio, ee...) when it is run, so `--help` and the light stages start fast.
+"""
+import argparse
+import importlib
+import json
+import sys
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent
+
+# Folder of the modules each stage imports
+STAGE_PATHS = {
+    'download': ROOT/'task3_data_download'/'data_download',
+    'crop': ROOT/'task4_resnet',
+    'stats': ROOT/'task4_resnet',
+    'train-sr': ROOT/'task9_srres'/'srgan_pytorch',
+    'super-resolve': ROOT/'task9_srres'/'nogan',
+    'classify': ROOT/'task4_resnet',
+    'map': ROOT/'task4_resnet',
+}
+
+
+def load(stage, module):
+    "Import `module` from the folder of `stage`, the stage modules import each other by plain name"
+    path = str(STAGE_PATHS[stage])
+    if not STAGE_PATHS[stage].is_dir():
+        # Only this file is installed, the stages are read from the repository it was installed from
+        sys.exit(f'wfp: {path} not found, install the command from the repository with `pip install -e .`')
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(module)
+
+
+def run_download(args):
+    download = load('download', 'download')
+    if args.survey is None:
+        download.download_random(args.nb_files or download.DOWNLOAD_NB_FILES, args.folder or download.GDRIVE_FOLDER,
+                                 not args.rgb, args.debug)
+    else:
+        # Labeled exports never go to the unlabeled folder indexed by embeddings.py
+        download.download_survey(args.survey, args.folder or download.SURVEY_GDRIVE_FOLDER, not args.rgb,
+                                 args.nb_files, args.debug)
+
+
+def run_crop(args):
+    load('crop', 'preprocessing').crop_folder_allbands(args.source, args.target, args.size)
+
+
+def run_stats(args):
+    preprocessing = load('stats', 'preprocessing')
+    paths = sorted(p for p in Path(args.folder).iterdir() if p.suffix in ['.npy', '.tif'])
+    if args.limit is not None:
+        paths = paths[:args.limit]
+    mean, std = preprocessing.band_stats(paths)
+    print(json.dumps({'tiles': len(paths), 'mean': mean, 'std': std}))
+
+
+def run_train_sr(args):
+    train = load('train-sr', 'train')
+    # train.main reads its configuration from the module constants
+    overrides = {'TRAIN_IMAGES_ROOT': args.train_root, 'VAL_IMAGES_ROOT': args.val_root,
+                 'TRAIN_CATALOG': args.train_catalog, 'VAL_CATALOG': args.val_catalog, 'EPOCHS': args.epochs,
+                 'TRAIN_BATCH_SIZE': args.batch_size, 'WORKERS': args.workers, 'DEVICE': args.device,
+                 'LOAD_CHECKPOINT': args.checkpoint, 'HR_PATCH': args.hr_patch and (args.hr_patch, args.hr_patch),
+                 'G_CHECKPOINT_SEGMENTS': args.g_checkpoint_segments,
+                 'D_CHECKPOINT_SEGMENTS': args.d_checkpoint_segments}
+    for name, value in overrides.items():
+        if value is not None:
+            setattr(train, name, value)
+    if args.profile:
+        train.PROFILE = True
+    train.main()
+
+
+def run_super_resolve(args):
+    superres_all = load('super-resolve', 'superres_all')
+    superres_all.super_resolve(args.images, args.output, args.learner, args.size)
+
+
+def run_classify(args):
+    serve = load('classify', 'serve')
+    serve.predict_folder(args.folder, args.output, args.predictor, args.batch_size, args.threads)
+
+
+def run_map(args):
+    mapping = load('map', 'mapping')
+    mapping.generate_map(args.raster, args.predictor, args.output, stride=args.stride, batch_size=args.batch_size,
+                         workers=args.workers)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='wfp', description='WFP Nepal crop mapping pipeline')
+    sub = parser.add_subparsers(dest='command', metavar='command')
+    sub.required = True
+
+    p = sub.add_parser('download', help='export Sentinel-2 tiles to Google Drive with Earth Engine')
+    p.add_argument('--survey', help='survey csv, one tile per point; random points of Nepal when not given')
+    p.add_argument('--folder', help='Google Drive folder, wfp-allbands-b1 for the survey tiles and '
+                                    'wfp-allbands-unlabeled-b1 for the random ones by default')
+    p.add_argument('--nb-files', type=int)
+    p.add_argument('--rgb', action='store_true', help='RGB visualization instead of the 13 bands')
+    p.add_argument('--debug', action='store_true')
+    p.set_defaults(func=run_download)
+
+    p = sub.add_parser('crop', help='center crop the 13-band tifs of a folder to .npy tiles')
+    p.add_argument('source')
+    p.add_argument('target')
+    p.add_argument('--size', type=int, default=64)
+    p.set_defaults(func=run_crop)
+
+    p = sub.add_parser('stats', help='per band mean and std of the .npy / .tif tiles of a folder')
+    p.add_argument('folder')
+    p.add_argument('--limit', type=int, help='only use the first LIMIT tiles')
+    p.set_defaults(func=run_stats)
+
+    p = sub.add_parser('train-sr', help='train the SRGAN of task9_srres/srgan_pytorch')
+    p.add_argument('--train-root')
+    p.add_argument('--val-root')
+    p.add_argument('--train-catalog')
+    p.add_argument('--val-catalog')
+    p.add_argument('--epochs', type=int)
+    p.add_argument('--batch-size', type=int)
+    p.add_argument('--workers', type=int)
+    p.add_argument('--device')
+    p.add_argument('--checkpoint', help='checkpoint to resume from')
+    p.add_argument('--hr-patch', type=int, help='side of the square HR training patches')
+    p.add_argument('--g-checkpoint-segments', type=int, help='recompute the generator trunk in that many segments')
+    p.add_argument('--d-checkpoint-segments', type=int, help='same for the discriminator layers')
+    p.add_argument('--profile', action='store_true', help='profile a few steps of the first epoch')
+    p.set_defaults(func=run_train_sr)
+
+    p = sub.add_parser('super-resolve', help='super resolve a folder of images with an exported fastai learner')
+    p.add_argument('images')
+    p.add_argument('output')
+    p.add_argument('--learner', default='test', help='folder of the exported learner')
+    p.add_argument('--size', type=int, default=570)
+    p.set_defaults(func=run_super_resolve)
+
+    p = sub.add_parser('classify', help='crop probabilities of the tiles of a folder, written to a csv')
+    p.add_argument('folder')
+    p.add_argument('output')
+    p.add_argument('--predictor', default='models/xresnet50-13bands.pt', help='exported TorchScript predictor')
+    p.add_argument('--batch-size', type=int, default=64)
+    p.add_argument('--threads', type=int, default=4)
+    p.set_defaults(func=run_classify)
+
+    p = sub.add_parser('map', help='sliding window crop probability map of a 13-band raster')
+    p.add_argument('raster')
+    p.add_argument('output')
+    p.add_argument('--predictor', default='models/xresnet50-13bands.pt', help='exported TorchScript predictor')
+    p.add_argument('--stride', type=int, default=32)
+    p.add_argument('--batch-size', type=int, default=256)
+    p.add_argument('--workers', type=int, default=4)
+    p.set_defaults(func=run_map)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()